@@ -45,7 +45,11 @@ def connect_whatsapp() -> tuple[Response, int]:
             message = "Plubot no encontrado o no tienes permiso"
             return jsonify({"status": "error", "message": message}), 404
 
-        if not validate_whatsapp_number(phone_number):
+        is_valid = validate_whatsapp_number(phone_number)
+        if is_valid is None:
+            message = "No se pudo validar el número con Twilio. Inténtalo más tarde."
+            return jsonify({"status": "error", "message": message}), 502
+        if not is_valid:
             message = "El número no está registrado en Twilio. Regístralo primero."
             return jsonify({"status": "error", "message": message}), 400
 
@@ -6,11 +6,18 @@ from typing import TYPE_CHECKING, Any
 
 from flask import Blueprint, current_app, jsonify, request
 from flask_jwt_extended import jwt_required
+import orjson
 import requests
 
 from models import WhatsAppConnection, db
 from services.flow_executor import FlowExecutor
-from services.whatsapp_service import WhatsAppService
+from services.twilio_service import invalidate_owned_numbers_cache
+from services.whatsapp_service import (
+    API_TIMEOUT,
+    WhatsAppService,
+    get_http_session,
+    invalidate_connected_plubot,
+)
 
 if TYPE_CHECKING:
     from flask.wrappers import Response
@@ -60,6 +67,8 @@ def connect_to_twilio() -> tuple[Response, int]:
         connection.status = "connected"
         connection.whatsapp_number = clean_phone_number
         db.session.commit()
+        invalidate_connected_plubot()
+        invalidate_owned_numbers_cache(clean_phone_number)
 
         logger.info(
             "Plubot %s successfully connected to Twilio number %s",
@@ -192,6 +201,7 @@ def update_session_status() -> tuple[Response, int]:
                 if status == "ready":
                     connection.whatsapp_number = data.get("phone_number")
                 db.session.commit()
+                invalidate_connected_plubot()
 
         logger.info("Session %s status updated to %s", session_id, status)
         return jsonify({"status": "success"}), 200
@@ -217,15 +227,15 @@ def start_qr_session() -> tuple[Response, int]:
 
     try:
         # Call Node.js microservice to create session
-        response = requests.post(
+        response = get_http_session().post(
             f"{WHATSAPP_SERVICE_URL}/api/sessions/create",
-            json={"userId": user_id, "plubotId": plubot_id},
-            headers={"X-API-Key": WHATSAPP_API_KEY},
-            timeout=10
+            data=orjson.dumps({"userId": user_id, "plubotId": plubot_id}),
+            headers={"X-API-Key": WHATSAPP_API_KEY, "Content-Type": "application/json"},
+            timeout=API_TIMEOUT,
         )
 
         if response.status_code == 200:
-            result = response.json()
+            result = orjson.loads(response.content)
 
             # Store connection in database
             connection = db.session.query(WhatsAppConnection).filter_by(
@@ -238,6 +248,7 @@ def start_qr_session() -> tuple[Response, int]:
 
             connection.status = "initializing"
             db.session.commit()
+            invalidate_connected_plubot()
 
             return jsonify(result), 200
         return jsonify({"error": "Failed to create session"}), response.status_code
@@ -264,14 +275,14 @@ def get_qr_status() -> tuple[Response, int]:
 
     try:
         # Call Node.js microservice to get status
-        response = requests.get(
+        response = get_http_session().get(
             f"{WHATSAPP_SERVICE_URL}/api/sessions/{session_id}/status",
             headers={"X-API-Key": WHATSAPP_API_KEY},
-            timeout=10
+            timeout=API_TIMEOUT,
         )
 
         if response.status_code == 200:
-            return jsonify(response.json()), 200
+            return jsonify(orjson.loads(response.content)), 200
         if response.status_code == 404:
             return jsonify({"error": "Session not found"}), 404
         return jsonify({"error": "Failed to get status"}), response.status_code
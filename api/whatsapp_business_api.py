@@ -8,6 +8,7 @@ import requests
 from flask import Blueprint, request, jsonify, Response
 from functools import wraps
 import jwt
+import orjson
 from redis import Redis
 import hashlib
 import hmac
@@ -18,14 +19,19 @@ from datetime import datetime, timedelta
 
 from extensions import db
 from flask_jwt_extended import get_jwt_identity, jwt_required
+from kombu.exceptions import OperationalError
 
+from celery_tasks import process_whatsapp_webhook, send_whatsapp_business_message
 from config.settings import Settings
 
 settings = Settings()
 
 from models.plubot import Plubot
 from models.whatsapp_business import WhatsAppBusiness
-from services.whatsapp_business_service import WhatsAppBusinessService
+from services.whatsapp_business_service import (
+    WhatsAppBusinessService,
+    invalidate_account_cache,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -52,8 +58,8 @@ class RegistrationStatus(Enum):
 whatsapp_business_bp = Blueprint("whatsapp_business", __name__)
 
 def get_whatsapp_service() -> WhatsAppBusinessService:
-    """Obtiene una instancia del servicio de WhatsApp Business."""
-    return WhatsAppBusinessService()
+    """Obtiene el servicio de WhatsApp Business compartido por la aplicación."""
+    return WhatsAppBusinessService.for_app()
 
 @whatsapp_business_bp.route("/wa/status/<int:plubot_id>", methods=["GET"])
 @jwt_required()
@@ -176,7 +182,7 @@ def oauth_callback() -> tuple[Response, int]:
         logger.info("Webhook recibido: %s", request.method)
 
         # Intercambiar código por token
-        service = WhatsAppBusinessService()
+        service = get_whatsapp_service()
         success = service.exchange_token(code, plubot_id)
 
         if success:
@@ -218,8 +224,9 @@ def configure_whatsapp(plubot_id: int) -> tuple[Response, int]:
         if "business_name" in data:
             whatsapp.business_name = data["business_name"]
 
-        whatsapp.updated_at = datetime.now(UTC)
+        # updated_at lo actualiza la base de datos (onupdate del modelo)
         db.session.commit()
+        invalidate_account_cache(plubot_id)
 
         return jsonify({
             "status": "success",
@@ -267,12 +274,24 @@ def disconnect_whatsapp(plubot_id: int) -> tuple[Response, int]:
 @whatsapp_business_bp.route("/wa/send/<int:plubot_id>", methods=["POST"])
 @jwt_required()
 def send_whatsapp_message(plubot_id: int) -> tuple[Response, int]:
-    """Envía un mensaje de WhatsApp."""
+    """Envía un mensaje de WhatsApp.
+
+    Con `"queue": true` el envío lo hace un worker y se responde 202 con el ID
+    de la tarea, sin esperar a la Graph API.
+    """
     try:
         data = request.get_json()
         to = data.get("to")
         message = data.get("message")
 
+        if data.get("queue"):
+            try:
+                task = send_whatsapp_business_message.delay(plubot_id, to, message)
+            except OperationalError:
+                logger.exception("Cola no disponible; enviando el mensaje en línea")
+            else:
+                return jsonify({"status": "queued", "task_id": task.id}), 202
+
         service = get_whatsapp_service()
         result = service.send_message(plubot_id, to, message)
 
@@ -303,13 +322,20 @@ def whatsapp_webhook() -> tuple[Response, int]:
 
     # Recepción de mensajes (POST)
     try:
-        data = request.get_json()
+        try:
+            data = orjson.loads(request.get_data())
+        except orjson.JSONDecodeError:
+            return jsonify({"status": "error"}), 400
 
         if not data:
             return jsonify({"status": "error"}), 400
 
-        service = get_whatsapp_service()
-        service.process_webhook(data)
+        # Se confirma a Meta en cuanto el lote está en la cola; lo procesa un worker
+        try:
+            process_whatsapp_webhook.delay(data)
+        except OperationalError:
+            logger.exception("Cola no disponible; procesando el webhook en línea")
+            get_whatsapp_service().process_webhook(data)
 
         return jsonify({"status": "success"}), 200
 
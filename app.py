@@ -12,6 +12,7 @@ from flask import Flask, Response, jsonify, redirect, request
 from flask_cors import CORS
 from flask_jwt_extended.exceptions import NoAuthorizationError
 from jwt.exceptions import ExpiredSignatureError, InvalidSignatureError
+from sqlalchemy.orm import configure_mappers
 from werkzeug.exceptions import Unauthorized
 
 from api import api_bp
@@ -27,6 +28,8 @@ from api.whatsapp_migration_api import whatsapp_migration_bp
 from config.settings import load_config
 from models.token_blocklist import TokenBlocklist
 from models.user import User
+from services.mail_service import init_mail
+from utils.json_provider import OrjsonProvider
 from utils.logging import setup_logging
 from utils.templates import load_initial_templates
 
@@ -45,10 +48,13 @@ def create_app() -> Flask:
     )
 
     app = Flask(__name__, instance_relative_config=True)
+    app.json = OrjsonProvider(app)
     load_config(app)
 
     register_extensions(app)
     register_blueprints(app)
+    # Configura los mappers al arrancar para no pagar ese coste en la primera petición
+    configure_mappers()
     register_error_handlers(app)
     register_shell_context(app)
     register_commands(app)
@@ -75,6 +81,7 @@ def register_extensions(app: Flask) -> None:
     migrate.init_app(app, db)
     jwt.init_app(app)
     mail.init_app(app)
+    init_mail(app)
 
     # Configuración de Limiter con manejo de SSL para Redis
     redis_url = app.config.get("REDIS_URL")
@@ -1,13 +1,16 @@
 import io
 import logging
 import os
+from typing import Any
 
 from celery import Celery
 import PyPDF2
 import requests
+from sqlalchemy.exc import SQLAlchemyError
 
 from config.settings import get_session
 from models.plubot import Plubot
+from models.whatsapp_business import WhatsAppWebhookEvent
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +29,8 @@ celery_app.conf.update(
     enable_utc=True,
     broker_connection_retry_on_startup=True,
     broker_pool_limit=3,
+    # Con acks_late, cada worker reserva una sola tarea para no retener webhooks
+    worker_prefetch_multiplier=1,
     result_expires=3600,
     broker_transport_options={
         "max_retries": 5,
@@ -77,3 +82,66 @@ def process_pdf_async(chatbot_id: str, pdf_url: str) -> None:
             logger.info("PDF procesado y guardado para plubot %s", chatbot_id)
         else:
             logger.warning("No se encontró el plubot con id %s", chatbot_id)
+
+
+@celery_app.task(bind=True, max_retries=5, default_retry_delay=5)
+def persist_outbound_event(
+    self,  # noqa: ANN001
+    whatsapp_business_id: int,
+    event_data: dict[str, Any],
+) -> None:
+    """Guarda el evento de un mensaje de WhatsApp Business enviado.
+
+    La fila del mensaje ya se escribió al enviarlo; el evento solo registra la
+    petición y la respuesta de Meta. Un fallo revierte la transacción, así que
+    el reintento no lo duplica.
+    """
+    try:
+        with get_session() as session:
+            session.add(
+                WhatsAppWebhookEvent(
+                    whatsapp_business_id=whatsapp_business_id,
+                    event_type="message",
+                    event_data=event_data,
+                )
+            )
+    except SQLAlchemyError as exc:
+        logger.exception("Error guardando el evento del mensaje enviado")
+        raise self.retry(exc=exc) from exc
+
+
+@celery_app.task(bind=True, acks_late=True, max_retries=5, default_retry_delay=5)
+def process_whatsapp_webhook(self, data: dict[str, Any]) -> None:  # noqa: ANN001
+    """Procesa un webhook de WhatsApp Business ya confirmado a Meta.
+
+    Se reintenta si el lote se revierte: los message_id ya guardados se ignoran
+    y los estados son idempotentes, así que reprocesarlo no duplica filas.
+    """
+    # Importaciones diferidas: app importa este módulo a través del servicio
+    from app import app  # noqa: PLC0415
+
+    from services.whatsapp_business_service import WhatsAppBusinessService  # noqa: PLC0415
+
+    with app.app_context():
+        if not WhatsAppBusinessService.for_app(app).process_webhook(data):
+            raise self.retry()
+
+
+@celery_app.task
+def send_whatsapp_business_message(
+    plubot_id: int, to: str, message: str | dict[str, Any], message_type: str = "text"
+) -> str | None:
+    """Envía un mensaje de WhatsApp Business fuera del hilo de la petición.
+
+    Devuelve el ID del mensaje asignado por Meta (queda en el backend de
+    resultados). No se reintenta: la Graph API no es idempotente y un reintento
+    tras un envío aceptado duplicaría el mensaje.
+    """
+    # Importaciones diferidas: app importa este módulo a través del servicio
+    from app import app  # noqa: PLC0415
+
+    from services.whatsapp_business_service import WhatsAppBusinessService  # noqa: PLC0415
+
+    with app.app_context():
+        service = WhatsAppBusinessService.for_app(app)
+        return service.send_message(plubot_id, to, message, message_type)
@@ -7,6 +7,7 @@ from pathlib import Path
 from typing import TYPE_CHECKING
 
 from dotenv import load_dotenv
+import orjson
 from sqlalchemy import create_engine
 from sqlalchemy.orm import Session, sessionmaker
 
@@ -74,7 +75,9 @@ class Settings:
         self.ENCRYPTION_KEY: str | None = os.getenv("ENCRYPTION_KEY")
         self.OPINION_RECIPIENT_EMAIL: str | None = os.getenv("OPINION_RECIPIENT_EMAIL")
         self.BACKEND_URL: str | None = os.getenv("BACKEND_URL")
-        
+        # Modelo local de fastText (opcional) para detección de emociones
+        self.EMOTION_MODEL_PATH: str | None = os.getenv("EMOTION_MODEL_PATH")
+
         # WhatsApp Microservice (whatsapp-web.js)
         self.WHATSAPP_API_URL: str | None = os.getenv("WHATSAPP_API_URL", "http://localhost:3001")
         self.WHATSAPP_API_KEY: str | None = os.getenv("WHATSAPP_API_KEY")
@@ -133,11 +136,24 @@ class Settings:
 settings = Settings()
 
 
+def _json_serializer(obj: object) -> str:
+    """Serializa las columnas JSON con orjson (el driver espera str, no bytes)."""
+    return orjson.dumps(obj).decode()
+
+
+# Opciones comunes a los engines de Flask-SQLAlchemy y de get_session
+ENGINE_OPTIONS = {
+    "json_serializer": _json_serializer,
+    "json_deserializer": orjson.loads,
+}
+
+
 def load_config(app: "Flask") -> None:
     """Carga la configuración desde el objeto settings a la app de Flask."""
     app.config["SECRET_KEY"] = settings.SECRET_KEY
     app.config["SQLALCHEMY_DATABASE_URI"] = settings.DATABASE_URL
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = ENGINE_OPTIONS
     app.config["DATABASE_URL"] = settings.DATABASE_URL
     app.config["REDIS_URL"] = settings.REDIS_URL
     app.config["JWT_SECRET_KEY"] = settings.JWT_SECRET_KEY
@@ -170,7 +186,7 @@ def load_config(app: "Flask") -> None:
 
 
 # Configuración de SQLAlchemy para uso fuera de Flask (si es necesario)
-engine = create_engine(settings.DATABASE_URL)
+engine = create_engine(settings.DATABASE_URL, **ENGINE_OPTIONS)
 SessionLocal = sessionmaker(bind=engine)
 
 
@@ -0,0 +1,41 @@
+"""Make whatsapp_messages.message_id unique
+
+INSERT ... ON CONFLICT (message_id) needs a unique index on message_id, but
+add_whatsapp_business created a plain one. Rows duplicated by redelivered
+webhooks are removed first, keeping the oldest row of each message_id.
+
+Revision ID: 5c81d0e7a3f2
+Revises: ad908d9ce0a4
+Create Date: 2026-10-16 14:05:37.201846
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5c81d0e7a3f2'
+down_revision = 'ad908d9ce0a4'
+branch_labels = None
+depends_on = 'add_whatsapp_business'
+
+
+def upgrade():
+    op.execute(
+        """
+        DELETE FROM whatsapp_messages AS duplicate
+        USING whatsapp_messages AS kept
+        WHERE duplicate.message_id = kept.message_id
+          AND duplicate.id > kept.id
+        """
+    )
+    op.drop_index('ix_whatsapp_messages_message_id', table_name='whatsapp_messages')
+    op.create_index(
+        'ix_whatsapp_messages_message_id', 'whatsapp_messages', ['message_id'], unique=True
+    )
+
+
+def downgrade():
+    op.drop_index('ix_whatsapp_messages_message_id', table_name='whatsapp_messages')
+    op.create_index(
+        'ix_whatsapp_messages_message_id', 'whatsapp_messages', ['message_id'], unique=False
+    )
@@ -0,0 +1,50 @@
+"""Replace the whatsapp_business.phone_number_id index with a partial one for active accounts
+
+Lookups by phone_number_id always filter on is_active, so the full index from
+add_whatsapp_business is dropped in favour of the partial one.
+
+Revision ID: ad908d9ce0a4
+Revises: ebe437ba2d7f
+Create Date: 2026-10-16 11:21:03.884152
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ad908d9ce0a4'
+down_revision = 'ebe437ba2d7f'
+branch_labels = None
+depends_on = 'add_whatsapp_business'
+
+
+def upgrade():
+    op.create_index(
+        'ix_whatsapp_business_active_phone_number_id',
+        'whatsapp_business',
+        ['phone_number_id'],
+        unique=False,
+        postgresql_where=sa.text('is_active'),
+        if_not_exists=True,
+    )
+    op.drop_index(
+        'ix_whatsapp_business_phone_number_id',
+        table_name='whatsapp_business',
+        if_exists=True,
+    )
+
+
+def downgrade():
+    op.create_index(
+        'ix_whatsapp_business_phone_number_id',
+        'whatsapp_business',
+        ['phone_number_id'],
+        unique=False,
+        if_not_exists=True,
+    )
+    op.drop_index(
+        'ix_whatsapp_business_active_phone_number_id',
+        table_name='whatsapp_business',
+        if_exists=True,
+    )
@@ -0,0 +1,39 @@
+"""Add lowercased label generated column to flow_edges
+
+Revision ID: e13a125a563f
+Revises: c4434d1688de
+Create Date: 2026-10-16 10:02:14.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e13a125a563f'
+down_revision = 'c4434d1688de'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.add_column(
+        'flow_edges',
+        sa.Column(
+            'label_lc', sa.Text(), sa.Computed('lower(label)', persisted=True), nullable=True
+        ),
+    )
+    op.create_index(
+        'idx_flow_edge_label_lc_trgm',
+        'flow_edges',
+        ['label_lc'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'label_lc': 'gin_trgm_ops'},
+    )
+
+
+def downgrade():
+    op.drop_index('idx_flow_edge_label_lc_trgm', table_name='flow_edges')
+    op.drop_column('flow_edges', 'label_lc')
@@ -0,0 +1,47 @@
+"""Add server-side UTC defaults to the WhatsApp Business timestamp columns
+
+The models no longer set created_at/updated_at from Python, so the database
+must provide them.
+
+Revision ID: ebe437ba2d7f
+Revises: e13a125a563f
+Create Date: 2026-10-16 11:20:41.527309
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'ebe437ba2d7f'
+down_revision = 'e13a125a563f'
+branch_labels = None
+# The WhatsApp Business tables come from the separate add_whatsapp_business root.
+depends_on = 'add_whatsapp_business'
+
+TIMESTAMP_COLUMNS = [
+    ('whatsapp_business', 'created_at'),
+    ('whatsapp_business', 'updated_at'),
+    ('whatsapp_messages', 'created_at'),
+    ('whatsapp_webhook_events', 'created_at'),
+]
+
+
+def upgrade():
+    for table_name, column_name in TIMESTAMP_COLUMNS:
+        op.alter_column(
+            table_name,
+            column_name,
+            existing_type=sa.DateTime(),
+            server_default=sa.text("timezone('utc', now())"),
+        )
+
+
+def downgrade():
+    for table_name, column_name in TIMESTAMP_COLUMNS:
+        op.alter_column(
+            table_name,
+            column_name,
+            existing_type=sa.DateTime(),
+            server_default=None,
+        )
@@ -5,7 +5,7 @@ from __future__ import annotations
 from datetime import datetime
 from typing import TYPE_CHECKING
 
-from sqlalchemy import DateTime, ForeignKey, Index, Integer, String
+from sqlalchemy import DateTime, ForeignKey, Index, Integer, String, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
 from models.base import Base
@@ -33,8 +33,9 @@ class ConversationState(Base):
 
     # Campos de auditoría
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+    # Cada mensaje actualiza el estado: la hora del UPDATE la pone PostgreSQL (en UTC)
     updated_at: Mapped[datetime] = mapped_column(
-        DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        DateTime, default=datetime.utcnow, onupdate=text("timezone('utc', now())")
     )
 
     # Relaciones
@@ -8,6 +8,7 @@ from typing import TYPE_CHECKING
 from sqlalchemy import (
     JSON,
     Boolean,
+    Computed,
     DateTime,
     ForeignKey,
     Index,
@@ -42,6 +43,10 @@ class FlowEdge(Base):
     # Campos funcionales
     condition: Mapped[str] = mapped_column(Text, default="")
     label: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    # Columna generada por la BD con la etiqueta en minúsculas para búsquedas con LIKE
+    label_lc: Mapped[str | None] = mapped_column(
+        Text, Computed("lower(label)", persisted=True), nullable=True
+    )
 
     # Campos técnicos para UI
     edge_type: Mapped[str] = mapped_column(String(50), default="default")
@@ -74,6 +79,12 @@ class FlowEdge(Base):
         Index("idx_flow_edge_chatbot", chatbot_id),
         Index("idx_flow_edge_source_target", chatbot_id, source_flow_id, target_flow_id),
         Index("idx_flow_edge_frontend_id", chatbot_id, frontend_id),
+        Index(
+            "idx_flow_edge_label_lc_trgm",
+            label_lc,
+            postgresql_using="gin",
+            postgresql_ops={"label_lc": "gin_trgm_ops"},
+        ),
     )
 
     def __repr__(self) -> str:
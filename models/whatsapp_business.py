@@ -1,13 +1,23 @@
 """Modelo para la integración con WhatsApp Business API."""
-from datetime import datetime
-
 from extensions import db
 
+# Las columnas son `timestamp without time zone` en UTC: la hora la pone PostgreSQL
+# en lugar de construir un datetime en Python para cada fila.
+_UTC_NOW_SQL = "timezone('utc', now())"
+
 
 class WhatsAppBusiness(db.Model):
     """Modelo para almacenar información de cuentas de WhatsApp Business."""
 
     __tablename__ = "whatsapp_business"
+    # Búsqueda de la cuenta activa a partir del phone_number_id de cada webhook
+    __table_args__ = (
+        db.Index(
+            "ix_whatsapp_business_active_phone_number_id",
+            "phone_number_id",
+            postgresql_where=db.text("is_active"),
+        ),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     # Fixed foreign key reference - must point to plubots table (plural)
@@ -28,8 +38,10 @@ class WhatsAppBusiness(db.Model):
     is_active = db.Column(db.Boolean, default=True)
 
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=db.text(_UTC_NOW_SQL))
+    updated_at = db.Column(
+        db.DateTime, server_default=db.text(_UTC_NOW_SQL), onupdate=db.text(_UTC_NOW_SQL)
+    )
 
     # Relaciones
     messages = db.relationship("WhatsAppMessage", backref="whatsapp_account", lazy="dynamic")
@@ -52,7 +64,7 @@ class WhatsAppMessage(db.Model):
     )
 
     # Información del mensaje
-    message_id = db.Column(db.String(200), unique=True)
+    message_id = db.Column(db.String(200), unique=True, index=True)
     from_number = db.Column(db.String(20), nullable=False)
     to_number = db.Column(db.String(20), nullable=False)
     message_type = db.Column(db.String(50))  # text, image, audio, video, document, location
@@ -70,7 +82,7 @@ class WhatsAppMessage(db.Model):
     message_metadata = db.Column(db.JSON)
 
     # Timestamps
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=db.text(_UTC_NOW_SQL))
     delivered_at = db.Column(db.DateTime)
     read_at = db.Column(db.DateTime)
 
@@ -99,7 +111,7 @@ class WhatsAppWebhookEvent(db.Model):
     error_message = db.Column(db.Text)
 
     # Timestamp
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, server_default=db.text(_UTC_NOW_SQL))
 
     def __repr__(self) -> str:
         status = "Processed" if self.processed else "Pending"
@@ -1,17 +1,31 @@
 """Motor de ejecución de flujos de chatbot."""
 
+from functools import lru_cache
+import hashlib
 import logging
 from typing import Any, Final
 
 from extensions import db
-from sqlalchemy import and_
+import redis
+from sqlalchemy import event, func, literal, select
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, object_session
 
 from models import ConversationState, Flow, FlowEdge
 from services import whatsapp_service
+from utils.invalidation import InvalidationChannel
+from utils.redis_client import get_redis_client
 
 logger: Final = logging.getLogger(__name__)
 
+# Canal de Redis para propagar la invalidación de la caché de nodos de inicio
+# entre los distintos workers.
+_FLOW_INVALIDATE_CHANNEL: Final = "flow:invalidate"
+_FLOW_CHANGED_KEY: Final = "flow_executor.flow_changed"
+_EDGE_SOURCES_KEY: Final = "flow_executor.edge_sources"
+# TTL (segundos) de la caché negativa para mensajes que no coinciden con ninguna arista.
+_EDGE_MISS_TTL: Final = 30
+
 _FALLBACK_MESSAGE: Final = (
     "Lo siento, no he entendido esa respuesta. "
     "Por favor, intenta de nuevo con una de las opciones disponibles."
@@ -20,16 +34,88 @@ _FALLBACK_MESSAGE: Final = (
 
 def _get_conversation_state(plubot_id: str, contact: str) -> ConversationState | None:
     """Recupera el estado de la conversación actual para un contacto."""
-    return db.session.query(ConversationState).filter_by(
-        plubot_id=plubot_id, contact_identifier=contact
-    ).first()
+    stmt = (
+        select(ConversationState)
+        .where(
+            ConversationState.plubot_id == plubot_id,
+            ConversationState.contact_identifier == contact,
+        )
+        .limit(1)
+    )
+    return db.session.scalar(stmt)
+
+
+@lru_cache(maxsize=10_000)
+def _find_start_node_id(plubot_id: str) -> int | None:
+    """Devuelve el ID del nodo de inicio de un Plubot (un nodo sin aristas entrantes).
+
+    El resultado se memoiza por proceso; se invalida cuando cambia algún Flow o FlowEdge.
+    """
+    stmt = (
+        select(Flow.id)
+        .where(Flow.chatbot_id == plubot_id, ~Flow.incoming_edges.any())
+        .limit(1)
+    )
+    return db.session.scalar(stmt)
+
+
+_start_node_invalidation: Final = InvalidationChannel(
+    _FLOW_INVALIDATE_CHANNEL, _find_start_node_id.cache_clear, "flujos"
+)
 
 
 def _find_start_node(plubot_id: str) -> Flow | None:
     """Encuentra el nodo de inicio para un Plubot (un nodo sin aristas entrantes)."""
-    return db.session.query(Flow).filter(
-        and_(Flow.chatbot_id == plubot_id, ~Flow.incoming_edges.any())
-    ).first()
+    _start_node_invalidation.ensure_started()
+    start_node_id = _find_start_node_id(plubot_id)
+    if start_node_id is None:
+        return None
+    return db.session.get(Flow, start_node_id)
+
+
+def invalidate_edge_miss_cache(source_flow_ids: set[int]) -> None:
+    """Borra la caché negativa de aristas de los nodos origen indicados."""
+    if not source_flow_ids:
+        return
+    redis_client = get_redis_client()
+    if not redis_client:
+        return
+    try:
+        redis_client.delete(*(_edge_miss_key(flow_id) for flow_id in source_flow_ids))
+    except redis.exceptions.RedisError:
+        logger.exception("No se pudo invalidar la caché negativa de aristas.")
+
+
+def invalidate_start_node_cache() -> None:
+    """Limpia la caché de nodos de inicio y notifica al resto de workers."""
+    _start_node_invalidation.publish()
+
+
+@event.listens_for(Flow, "after_insert")
+@event.listens_for(Flow, "after_update")
+@event.listens_for(Flow, "after_delete")
+@event.listens_for(FlowEdge, "after_insert")
+@event.listens_for(FlowEdge, "after_update")
+@event.listens_for(FlowEdge, "after_delete")
+def _on_flow_changed(
+    _mapper: Any,  # noqa: ANN401
+    _connection: Any,  # noqa: ANN401
+    target: Flow | FlowEdge,
+) -> None:
+    """Marca la sesión para invalidar las cachés de nodos y aristas tras el commit."""
+    _find_start_node_id.cache_clear()
+    session = object_session(target)
+    if session is not None:
+        session.info[_FLOW_CHANGED_KEY] = True
+        if isinstance(target, FlowEdge) and target.source_flow_id is not None:
+            session.info.setdefault(_EDGE_SOURCES_KEY, set()).add(target.source_flow_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _on_session_commit(session: Session) -> None:
+    if session.info.pop(_FLOW_CHANGED_KEY, False):
+        invalidate_start_node_cache()
+    invalidate_edge_miss_cache(session.info.pop(_EDGE_SOURCES_KEY, set()))
 
 
 def _find_next_node_from_message(
@@ -38,21 +124,60 @@ def _find_next_node_from_message(
 ) -> Flow | None:
     """Encuentra el siguiente nodo basado en el mensaje del usuario.
 
-    Nota: Esta implementación utiliza una coincidencia parcial insensible a mayúsculas.
-    Para un sistema en producción, se recomienda usar NLP o machine learning.
+    Nota: Esta implementación utiliza una coincidencia parcial insensible a mayúsculas
+    sobre la columna generada `label_lc`. Para un sistema en producción, se recomienda
+    usar NLP o machine learning.
     """
-    matching_edge = db.session.query(FlowEdge).filter(
-        and_(
+    miss_key = _edge_miss_key(current_node.id)
+    miss_field = hashlib.blake2b(message_text.encode(), digest_size=16).hexdigest()
+    redis_client = get_redis_client()
+    if redis_client:
+        try:
+            if redis_client.hexists(miss_key, miss_field):
+                return None
+        except redis.exceptions.RedisError:
+            logger.exception("Error leyendo la caché negativa de aristas.")
+            redis_client = None
+
+    # Los comodines del mensaje se escapan para que coincidan de forma literal, y se pasa
+    # a minúsculas en la base de datos, con las mismas reglas que generan `label_lc`.
+    escaped_text = message_text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    pattern = f"%{escaped_text}%"
+    # Se selecciona directamente el nodo destino para evitar la carga perezosa de la arista.
+    stmt = (
+        select(Flow)
+        .join(FlowEdge, FlowEdge.target_flow_id == Flow.id)
+        .where(
             FlowEdge.source_flow_id == current_node.id,
-            FlowEdge.label.ilike(f"%{message_text}%"),
+            FlowEdge.label_lc.like(func.lower(literal(pattern)), escape="\\"),
         )
-    ).first()
+        .limit(1)
+    )
+    target_node = db.session.scalar(stmt)
+
+    if target_node:
+        return target_node
 
-    if matching_edge:
-        return matching_edge.target_node
+    if redis_client:
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.hset(miss_key, miss_field, "1")
+            pipe.expire(miss_key, _EDGE_MISS_TTL)
+            pipe.execute()
+        except redis.exceptions.RedisError:
+            logger.exception("Error escribiendo la caché negativa de aristas.")
     return None
 
 
+def _edge_miss_key(source_flow_id: int) -> str:
+    """Construye la clave del hash de Redis con los mensajes sin arista de un nodo.
+
+    Cada campo es el digest de un mensaje; agruparlos por nodo origen permite
+    invalidarlos con un solo DEL cuando cambian sus aristas.
+    """
+    return f"miss:{source_flow_id}"
+
+
 def _update_conversation_state(
     state: ConversationState | None,
     plubot_id: str,
@@ -71,6 +196,16 @@ def _update_conversation_state(
         db.session.add(new_state)
 
 
+def _send_message(contact: str, text: str, plubot_id: str) -> None:
+    """Envía un mensaje por WhatsApp sin propagar errores del proveedor."""
+    try:
+        whatsapp_service.WhatsAppService().send_whatsapp_message(plubot_id, contact, text)
+    except Exception:
+        logger.exception(
+            "Error enviando el mensaje del plubot %s a %s.", plubot_id, contact
+        )
+
+
 def _send_fallback_message(contact: str, plubot_id: str) -> None:
     """Envía un mensaje de fallback cuando no se puede determinar el siguiente paso."""
     logger.warning(
@@ -78,12 +213,15 @@ def _send_fallback_message(contact: str, plubot_id: str) -> None:
         plubot_id,
         contact,
     )
-    whatsapp_service.send_whatsapp_message(contact, _FALLBACK_MESSAGE, plubot_id)
+    _send_message(contact, _FALLBACK_MESSAGE, plubot_id)
 
 
 def trigger_flow(plubot_id: str, sender_contact: str, message_text: str) -> None:
     """Gestiona el flujo de la conversación basado en el estado del usuario.
 
+    El estado se actualiza y la sesión se cierra antes de llamar a la API de
+    WhatsApp, para no retener una conexión de la base de datos durante el envío.
+
     Args:
         plubot_id: El ID del Plubot que gestiona la conversación.
         sender_contact: El identificador del contacto (ej. número de WhatsApp).
@@ -96,6 +234,8 @@ def trigger_flow(plubot_id: str, sender_contact: str, message_text: str) -> None
         message_text,
     )
 
+    next_node_id: int | None = None
+    reply: str | None = None
     try:
         state = _get_conversation_state(plubot_id, sender_contact)
         next_node: Flow | None = None
@@ -113,24 +253,14 @@ def trigger_flow(plubot_id: str, sender_contact: str, message_text: str) -> None
             logger.info("Nueva conversación. Buscando un nodo de inicio.")
             next_node = _find_start_node(plubot_id)
 
-        if not next_node:
-            _send_fallback_message(sender_contact, plubot_id)
-            return
-
-        logger.info("Siguiente nodo determinado: %s", next_node.id)
-        whatsapp_service.send_whatsapp_message(
-            sender_contact, next_node.bot_response, plubot_id
-        )
-
-        _update_conversation_state(state, plubot_id, sender_contact, next_node.id)
-
-        db.session.commit()
-        logger.info(
-            "Estado de la conversación para %s actualizado al nodo %s",
-            sender_contact,
-            next_node.id,
-        )
-
+        if next_node:
+            # Se leen los atributos antes del commit, que expira los objetos de la sesión.
+            node_id = next_node.id
+            reply = next_node.bot_response
+            logger.info("Siguiente nodo determinado: %s", node_id)
+            _update_conversation_state(state, plubot_id, sender_contact, node_id)
+            db.session.commit()
+            next_node_id = node_id
     except SQLAlchemyError:
         logger.exception(
             "Error de base de datos ejecutando el flujo para plubot %s.", plubot_id
@@ -141,6 +271,18 @@ def trigger_flow(plubot_id: str, sender_contact: str, message_text: str) -> None
             "Error inesperado ejecutando el flujo para plubot %s.", plubot_id
         )
         db.session.rollback()
+    db.session.close()
+
+    if next_node_id is None:
+        _send_fallback_message(sender_contact, plubot_id)
+        return
+
+    _send_message(sender_contact, reply, plubot_id)
+    logger.info(
+        "Estado de la conversación para %s actualizado al nodo %s",
+        sender_contact,
+        next_node_id,
+    )
 
 
 class FlowExecutor:
@@ -191,26 +333,20 @@ class FlowExecutor:
                     "session_data": {"error": "no_matching_node"}
                 }
 
+            # Read node attributes before commit expires them, avoiding a re-SELECT
+            next_node_id = next_node.id
+            reply = next_node.bot_response
+            node_type = getattr(next_node, "node_type", "message")
+
             # Update conversation state
-            _update_conversation_state(state, plubot_id, user_phone, next_node.id)
+            _update_conversation_state(state, plubot_id, user_phone, next_node_id)
             db.session.commit()
 
             self.logger.info(
                 "Conversation state for %s updated to node %s",
-                user_phone, next_node.id
+                user_phone, next_node_id
             )
 
-            # Return the bot response
-            return {
-                "reply": next_node.bot_response or "Mensaje recibido.",
-                "session_data": {
-                    "current_node_id": next_node.id,
-                    "node_type": (
-                        next_node.node_type if hasattr(next_node, "node_type") else "message"
-                    )
-                }
-            }
-
         except SQLAlchemyError:
             self.logger.exception("Database error in WhatsApp flow execution")
             db.session.rollback()
@@ -227,3 +363,12 @@ class FlowExecutor:
             }
 
 
+        else:
+            # Return the bot response
+            return {
+                "reply": reply or "Mensaje recibido.",
+                "session_data": {
+                    "current_node_id": next_node_id,
+                    "node_type": node_type,
+                }
+            }
@@ -1,45 +1,67 @@
-import json
+from collections.abc import Callable
+from functools import lru_cache, wraps
+import hashlib
 import logging
+import random
+import re
+import secrets
+import threading
+import time
+from typing import Final, ParamSpec, TypeVar
 
-from ratelimit import limits
+from cachetools import LRUCache
+import orjson
 import redis
+from redis.commands.core import Script
 import requests
 from tenacity import retry, stop_after_attempt, wait_exponential
+from urllib3.util.retry import Retry
 
 from config.settings import settings
+from utils.circuit_breaker import CircuitBreaker
+from utils.http_session import SessionManager
+from utils.redis_client import get_redis_client, mark_redis_unavailable
 
-logger = logging.getLogger(__name__)
+try:
+    import fasttext
+except ImportError:  # Optional dependency: emotion detection falls back to Grok.
+    fasttext = None
 
+logger = logging.getLogger(__name__)
 
-class _RedisManager:
-    """Manages a singleton Redis client instance to avoid using globals."""
+P = ParamSpec("P")
+T = TypeVar("T")
 
-    _client: redis.Redis | None = None
+# Lifetime (seconds) of cached Grok responses and the Redis counter of cache misses.
+GROK_CACHE_TTL = 3600
+GROK_CACHE_MISS_COUNTER = "grok:miss"
 
-    def get_client(self) -> redis.Redis | None:
-        """Return a Redis client instance, creating it if it doesn't exist.
+_VALID_EMOTIONS: Final = frozenset({"joy", "sadness", "anger", "fear", "surprise", "disgust"})
+_NON_ALNUM: Final = re.compile(r"[^a-z0-9]")
+_EMOTION_WORD: Final = re.compile(r"[a-z]+")
+_DEFAULT_EMOTION: Final = "joy"  # Safe fallback
+# Normalized texts longer than this share the emotion cache entry of their prefix.
+_EMOTION_CACHE_KEY_LENGTH: Final = 512
+# Minimum confidence for the local classifier before falling back to Grok.
+_LOCAL_EMOTION_MIN_CONFIDENCE: Final = 0.7
+_emotion_cache: Final = LRUCache(maxsize=4096)
+_emotion_cache_lock: Final = threading.Lock()
 
-        If the connection fails, it returns None and logs the error.
-        """
-        if self._client is None:
-            if not settings.REDIS_URL:
-                logger.warning("Redis URL not configured. Cache service is disabled.")
-                return None
-            try:
-                client = redis.from_url(settings.REDIS_URL, decode_responses=True)
-                client.ping()
-                self._client = client
-                logger.info("Successfully connected to Redis for caching.")
-            except redis.exceptions.ConnectionError:
-                logger.exception(
-                    "Could not connect to Redis, caching will be disabled."
-                )
-                return None
-        return self._client
+XAI_CHAT_COMPLETIONS_URL: Final = "https://api.x.ai/v1/chat/completions"
 
 
-_redis_manager = _RedisManager()
-get_redis_client = _redis_manager.get_client
+# Pooled keep-alive session so xAI calls reuse TCP/TLS connections. POST is
+# retried on purpose: a chat completion has no side effects.
+_xai_session_manager: Final = SessionManager(
+    pool_connections=10,
+    pool_maxsize=50,
+    retry=Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+    ),
+)
 
 
 def get_cached_response(cache_key: str) -> str | None:
@@ -49,31 +71,228 @@ def get_cached_response(cache_key: str) -> str | None:
         return None
     try:
         return redis_client.get(cache_key)
+    except redis.exceptions.ConnectionError:
+        logger.exception("Lost connection to Redis cache.")
+        mark_redis_unavailable()
+        return None
     except redis.exceptions.RedisError:
         logger.exception("Error getting from Redis cache.")
         return None
 
 
 def cache_response(cache_key: str, response: str) -> None:
-    """Store a response in the Redis cache."""
+    """Store a response in the Redis cache and count the miss that produced it.
+
+    Both commands go out in a single non-transactional pipeline, so the
+    telemetry counter costs no extra round-trip.
+    """
     redis_client = get_redis_client()
     if not redis_client:
         return
     try:
-        # Cache for 1 hour
-        redis_client.setex(cache_key, 3600, response)
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.setex(cache_key, GROK_CACHE_TTL, response)
+        pipe.incr(GROK_CACHE_MISS_COUNTER)
+        pipe.execute()
+    except redis.exceptions.ConnectionError:
+        logger.exception("Lost connection to Redis cache.")
+        mark_redis_unavailable()
     except redis.exceptions.RedisError:
         logger.exception("Error writing to Redis cache.")
 
 
-@limits(calls=50, period=60)
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+# Atomic refill + consume for a token bucket stored as a Redis hash.
+# Uses the Redis server clock so every worker shares the same time source.
+_RATE_LIMIT_SCRIPT: Final = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate / 1000)
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+return {allowed, tostring(tokens)}
+"""
+
+
+@lru_cache(maxsize=8)
+def _get_script(redis_client: redis.Redis, source: str) -> Script:
+    """Register a Lua script once per client and reuse the Script object."""
+    return redis_client.register_script(source)
+
+
+class _LocalTokenBucket:
+    """In-process token bucket used while Redis is unavailable.
+
+    Each worker then enforces the full limit on its own, like the previous
+    per-process rate limiter, instead of letting calls through unthrottled.
+    """
+
+    def __init__(self, rate: float, capacity: int) -> None:
+        self._rate = rate
+        self._capacity = capacity
+        self._tokens = float(capacity)
+        self._timestamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self) -> float:
+        """Take a token; return 0 on success or the seconds until the next one."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self._capacity, self._tokens + (now - self._timestamp) * self._rate
+            )
+            self._timestamp = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self._rate
+
+
+_local_buckets: Final[dict[str, _LocalTokenBucket]] = {}
+_local_buckets_lock: Final = threading.Lock()
+
+
+def _consume_local_token(key: str, rate: float, capacity: int) -> float:
+    """Take a token from the in-process bucket for key."""
+    with _local_buckets_lock:
+        bucket = _local_buckets.get(key)
+        if bucket is None:
+            bucket = _local_buckets[key] = _LocalTokenBucket(rate, capacity)
+    return bucket.consume()
+
+
+def _consume_token(key: str, rate: float, capacity: int) -> float:
+    """Take a token from the shared bucket.
+
+    Returns 0 when a token was taken, otherwise the number of seconds to wait
+    until the next token is available. Falls back to an in-process bucket when
+    Redis is unavailable.
+    """
+    redis_client = get_redis_client()
+    if not redis_client:
+        return _consume_local_token(key, rate, capacity)
+    try:
+        allowed, tokens = _get_script(redis_client, _RATE_LIMIT_SCRIPT)(
+            keys=[key], args=[rate, capacity]
+        )
+    except redis.exceptions.RedisError:
+        logger.exception("Error consuming rate limit token for %s.", key)
+        return _consume_local_token(key, rate, capacity)
+    if allowed:
+        return 0
+    return (1 - float(tokens)) / rate
+
+
+def token_bucket(
+    key: str, rate: float, capacity: int
+) -> Callable[[Callable[P, T]], Callable[P, T]]:
+    """Rate-limit a function with a token bucket shared by all workers through Redis.
+
+    Calls over the limit sleep until a token is available, with jitter to avoid
+    every waiting worker retrying at the same instant.
+
+    Example:
+        @token_bucket("xai:emotion", rate=50 / 60, capacity=50)
+        def classify(text): ...
+    """
+
+    def decorator(func: Callable[P, T]) -> Callable[P, T]:
+        @wraps(func)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            while (wait := _consume_token(key, rate, capacity)) > 0:
+                time.sleep(wait + random.uniform(0, wait / 2))  # noqa: S311
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class _EmotionModelManager:
+    """Manages a singleton local fastText emotion model, loaded on first use."""
+
+    _model: "fasttext.FastText._FastText | None" = None
+    _loaded: bool = False
+
+    def get_model(self) -> "fasttext.FastText._FastText | None":
+        """Return the local model, or None if fastText or the model file is unavailable."""
+        if not self._loaded:
+            self._loaded = True
+            if fasttext is None or not settings.EMOTION_MODEL_PATH:
+                return None
+            try:
+                self._model = fasttext.load_model(settings.EMOTION_MODEL_PATH)
+                logger.info("Loaded local emotion model from %s.", settings.EMOTION_MODEL_PATH)
+            except ValueError:
+                logger.exception("Could not load local emotion model, using Grok only.")
+        return self._model
+
+
+_emotion_model_manager = _EmotionModelManager()
+
+
+def _classify_emotion_locally(text_to_analyze: str) -> str | None:
+    """Classify the text with the local model; None when it is missing or unsure."""
+    model = _emotion_model_manager.get_model()
+    if model is None:
+        return None
+    # fastText rejects newlines in the input text.
+    labels, probabilities = model.predict(text_to_analyze.replace("\n", " "), k=1)
+    if not labels or probabilities[0] < _LOCAL_EMOTION_MIN_CONFIDENCE:
+        return None
+    emotion = labels[0].removeprefix("__label__")
+    return emotion if emotion in _VALID_EMOTIONS else None
+
+
 def analyze_emotion(text_to_analyze: str) -> str:
     """Analyze the text to detect a predominant emotion.
 
-    Uses a specific prompt and a language model to classify the text
-    into one of the six basic emotions: 'joy', 'sadness', 'anger', 'fear',
-    'surprise', 'disgust'.
+    Classifies the text into one of the six basic emotions: 'joy', 'sadness',
+    'anger', 'fear', 'surprise', 'disgust'. A local fastText model is tried
+    first; Grok is only called when it is unavailable or not confident enough.
+    Results are memoized per worker process.
+    """
+    # Only the cache key is normalized and capped, so near-duplicates share an
+    # entry; the classifiers always see the original text.
+    cache_key = text_to_analyze.strip().lower()[:_EMOTION_CACHE_KEY_LENGTH]
+    with _emotion_cache_lock:
+        emotion = _emotion_cache.get(cache_key)
+    if emotion:
+        return emotion
+
+    emotion = _classify_emotion_locally(text_to_analyze) or _analyze_emotion_with_grok(
+        text_to_analyze
+    )
+    if emotion is None:
+        # The fallback is not cached so the text is classified again next time.
+        return _DEFAULT_EMOTION
+    with _emotion_cache_lock:
+        _emotion_cache[cache_key] = emotion
+    return emotion
+
+
+def clear_emotion_cache() -> None:
+    """Drop every memoized emotion of this worker process."""
+    with _emotion_cache_lock:
+        _emotion_cache.clear()
+
+
+@token_bucket("xai:emotion", rate=50 / 60, capacity=50)
+def _analyze_emotion_with_grok(text_to_analyze: str) -> str | None:
+    """Classify the emotion of the text with a specific prompt sent to Grok.
+
+    The reply is streamed through the shared cache, lock and breaker; transient
+    HTTP errors are already retried by the session adapter, so a failed stream
+    is not re-issued. Returns None when no valid emotion could be obtained.
     """
     system_prompt = (
         "Eres una IA experta en detección de emociones. Tu tarea es analizar el "
@@ -89,29 +308,153 @@ def analyze_emotion(text_to_analyze: str) -> str:
         {"role": "user", "content": text_to_analyze},
     ]
 
-    emotion = call_grok(messages, max_tokens=10, temperature=0.3)
+    # A cached reply may come from call_grok for the same prompt, so parse it too.
+    reply = _call_grok_single_flight(messages, _stream_grok_emotion)
+    return _parse_emotion(reply) if reply else None
+
 
-    valid_emotions = {"joy", "sadness", "anger", "fear", "surprise", "disgust"}
-    cleaned_emotion = "".join(e for e in emotion if e.isalnum()).lower()
+def _parse_emotion(reply: str) -> str | None:
+    """Extract one of the six valid emotions from a model reply, or None."""
+    # Fast path: the model usually answers with the bare word.
+    emotion = reply.strip().lower()
+    if emotion in _VALID_EMOTIONS:
+        return emotion
 
-    if cleaned_emotion in valid_emotions:
+    cleaned_emotion = _NON_ALNUM.sub("", emotion)
+    if cleaned_emotion in _VALID_EMOTIONS:
         return cleaned_emotion
 
-    return "joy"  # Safe fallback
+    return None
 
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def call_grok(messages: list[dict], max_tokens: int = 1024, temperature: float = 0.7) -> str:
-    """Call the Grok API, using a Redis cache if available."""
+def _stream_grok_emotion(messages: list[dict]) -> str | None:
+    """Stream the emotion reply and stop reading as soon as a valid emotion appears.
+
+    Only the first word matters, so the connection is dropped right after it
+    arrives instead of waiting for the whole generation. Returns None when no
+    valid emotion could be read, including malformed chunks; HTTP errors are
+    raised to _call_grok_single_flight.
+    """
+    payload, headers = _grok_request(messages, max_tokens=10, temperature=0.3)
+    payload["stream"] = True
+
+    content = ""
+    with _xai_session_manager.get_session().post(
+        XAI_CHAT_COMPLETIONS_URL,
+        data=orjson.dumps(payload),
+        headers=headers,
+        timeout=XAI_TIMEOUT,
+        stream=True,
+    ) as response:
+        response.raise_for_status()
+        try:
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line.removeprefix(b"data:").strip()
+                if data == b"[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices") or [{}]
+                content += choices[0].get("delta", {}).get("content") or ""
+                word = _EMOTION_WORD.search(content.lower())
+                if word and word.group() in _VALID_EMOTIONS:
+                    return word.group()
+        except (orjson.JSONDecodeError, AttributeError, IndexError, KeyError, TypeError):
+            logger.exception("Malformed chunk in the streamed emotion reply.")
+            return None
+    return _parse_emotion(content)
+
+
+_GROK_ERROR_MESSAGE: Final = "Error al conectar con la IA. Intenta de nuevo más tarde."
+
+# Single-flight lock so concurrent identical prompts trigger only one xAI call.
+_GROK_LOCK_TTL_MS: Final = 30_000
+_GROK_LOCK_MIN_WAIT: Final = 0.05
+_GROK_LOCK_MAX_WAIT: Final = 0.5
+_RELEASE_LOCK_SCRIPT: Final = (
+    "if redis.call('get', KEYS[1]) == ARGV[1] then "
+    "return redis.call('del', KEYS[1]) end return 0"
+)
+
+# (connect, read) timeouts: fail fast when xAI is unreachable, wait for slow generations.
+XAI_TIMEOUT: Final = (3.05, 30)
+
+# Breaker shared by all workers: repeated connect failures short-circuit xAI calls.
+_grok_breaker: Final = CircuitBreaker("grok", "xAI")
+
+
+def _trim_messages(messages: list[dict]) -> list[dict]:
+    """Keep the system prompt plus the last 9 messages of the conversation."""
     if len(messages) > 10:
-        messages = [messages[0], *messages[-9:]]
+        return [messages[0], *messages[-9:]]
+    return messages
+
+
+def _grok_cache_key(messages: list[dict]) -> str:
+    """Build a fixed-size Redis cache key from a fingerprint of the conversation."""
+    serialized = orjson.dumps(messages)
+    return f"grok:{hashlib.blake2b(serialized, digest_size=16).hexdigest()}"
+
+
+def _grok_lock_key(cache_key: str) -> str:
+    """Build a short Redis key for the single-flight lock of a cache key."""
+    return f"lock:grok:{hashlib.sha1(cache_key.encode()).hexdigest()}"  # noqa: S324
+
+
+def _acquire_grok_lock(lock_key: str) -> str | None:
+    """Try to take the single-flight lock.
+
+    Returns the lock token, or None if another worker already holds the lock.
+    If Redis is unavailable a token is returned anyway so the caller proceeds.
+    """
+    token = secrets.token_hex(8)
+    redis_client = get_redis_client()
+    if not redis_client:
+        return token
+    try:
+        acquired = redis_client.set(lock_key, token, nx=True, px=_GROK_LOCK_TTL_MS)
+    except redis.exceptions.RedisError:
+        logger.exception("Error acquiring Grok single-flight lock.")
+        return token
+    return token if acquired else None
+
+
+def _release_grok_lock(lock_key: str, token: str) -> None:
+    """Release the lock only if it is still owned by this token."""
+    redis_client = get_redis_client()
+    if not redis_client:
+        return
+    try:
+        _get_script(redis_client, _RELEASE_LOCK_SCRIPT)(keys=[lock_key], args=[token])
+    except redis.exceptions.RedisError:
+        logger.exception("Error releasing Grok single-flight lock.")
 
-    cache_key = json.dumps(messages)
-    cached_response = get_cached_response(cache_key)
-    if cached_response:
-        return cached_response
 
-    url = "https://api.x.ai/v1/chat/completions"
+def _wait_for_grok_cache(cache_key: str, lock_key: str) -> str | None:
+    """Poll the cache while another worker holds the lock, with exponential backoff."""
+    redis_client = get_redis_client()
+    if not redis_client:
+        return None
+    deadline = time.monotonic() + _GROK_LOCK_TTL_MS / 1000
+    delay = _GROK_LOCK_MIN_WAIT
+    try:
+        while time.monotonic() < deadline:
+            time.sleep(delay)
+            cached_response = redis_client.get(cache_key)
+            if cached_response:
+                return cached_response
+            if not redis_client.exists(lock_key):
+                return None
+            delay = min(delay * 2, _GROK_LOCK_MAX_WAIT)
+    except redis.exceptions.RedisError:
+        logger.exception("Error waiting for Grok single-flight result.")
+    return None
+
+
+def _grok_request(
+    messages: list[dict], max_tokens: int, temperature: float
+) -> tuple[dict, dict[str, str]]:
+    """Build the payload and headers for a chat completion request."""
     payload = {
         "model": "grok-3-latest",
         "messages": messages,
@@ -122,14 +465,74 @@ def call_grok(messages: list[dict], max_tokens: int = 1024, temperature: float =
         "Authorization": f"Bearer {settings.XAI_API_KEY}",
         "Content-Type": "application/json",
     }
+    return payload, headers
+
+
+def _call_grok_single_flight(
+    messages: list[dict], fetch: Callable[[list[dict]], str | None]
+) -> str | None:
+    """Run `fetch` against xAI behind the shared cache, single-flight lock and breaker.
+
+    Returns the cached or fetched reply, or None when the breaker is open or the
+    request failed. Connect failures count towards the breaker. Only non-empty
+    replies are cached.
+    """
+    messages = _trim_messages(messages)
+
+    cache_key = _grok_cache_key(messages)
+    cached_response = get_cached_response(cache_key)
+    if cached_response:
+        return cached_response
+
+    if _grok_breaker.is_open():
+        return None
+
+    lock_key = _grok_lock_key(cache_key)
+    lock_token = _acquire_grok_lock(lock_key)
+    if lock_token is None:
+        # Another worker is already asking xAI for this prompt: wait for its result.
+        cached_response = _wait_for_grok_cache(cache_key, lock_key)
+        if cached_response:
+            return cached_response
+    else:
+        # The previous lock holder may have filled the cache just before we got the lock.
+        cached_response = get_cached_response(cache_key)
+        if cached_response:
+            _release_grok_lock(lock_key, lock_token)
+            return cached_response
 
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
-        response.raise_for_status()
+        grok_response = fetch(messages)
+    except requests.exceptions.ConnectionError:
+        logger.exception("Could not connect to xAI API.")
+        _grok_breaker.record_failure()
+        return None
     except requests.exceptions.RequestException:
         logger.exception("Error connecting to xAI API.")
-        return "Error al conectar con la IA. Intenta de nuevo más tarde."
+        return None
     else:
-        grok_response = response.json()["choices"][0]["message"]["content"]
-        cache_response(cache_key, grok_response)
+        if grok_response:
+            cache_response(cache_key, grok_response)
         return grok_response
+    finally:
+        if lock_token:
+            _release_grok_lock(lock_key, lock_token)
+
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+def call_grok(messages: list[dict], max_tokens: int = 1024, temperature: float = 0.7) -> str:
+    """Call the Grok API, using a Redis cache if available."""
+
+    def fetch(trimmed_messages: list[dict]) -> str:
+        payload, headers = _grok_request(trimmed_messages, max_tokens, temperature)
+        response = _xai_session_manager.get_session().post(
+            XAI_CHAT_COMPLETIONS_URL,
+            data=orjson.dumps(payload),
+            headers=headers,
+            timeout=XAI_TIMEOUT,
+        )
+        response.raise_for_status()
+        return orjson.loads(response.content)["choices"][0]["message"]["content"]
+
+    grok_response = _call_grok_single_flight(messages, fetch)
+    return _GROK_ERROR_MESSAGE if grok_response is None else grok_response
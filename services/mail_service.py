@@ -1,20 +1,37 @@
 # plubot-backend/services/mail_service.py
-from flask import current_app
+from flask import Flask, current_app
 from flask_mail import Mail, Message
 
 mail = Mail()
 
+
+class _MailSettings:
+    """Guarda el remitente por defecto para evitar globales y lecturas por envío."""
+
+    sender: str | None = None
+
+
+_mail_settings = _MailSettings()
+
+
+def init_mail(app: Flask) -> None:
+    """Cachea el remitente por defecto; se llama una vez al crear la aplicación."""
+    _mail_settings.sender = app.config["MAIL_DEFAULT_SENDER"]
+
+
 def send_email(recipient: str, subject: str, body: str) -> None:
     """Envía un correo electrónico usando Flask-Mail."""
+    logger = current_app.logger
+    sender = _mail_settings.sender or current_app.config["MAIL_DEFAULT_SENDER"]
     try:
         msg = Message(
             subject=subject,
             recipients=[recipient],
             body=body,
-            sender=current_app.config["MAIL_DEFAULT_SENDER"],
+            sender=sender,
         )
         mail.send(msg)
-        current_app.logger.info("Correo enviado a %s con asunto: %s", recipient, subject)
+        logger.info("Correo enviado a %s con asunto: %s", recipient, subject)
     except Exception:
-        current_app.logger.exception("Error al enviar correo a %s", recipient)
+        logger.exception("Error al enviar correo a %s", recipient)
         raise
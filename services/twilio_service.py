@@ -1,12 +1,28 @@
+import json
 import logging
+import time
 
+import redis
 from twilio.base.exceptions import TwilioRestException
 from twilio.rest import Client
 
 from config.settings import settings
+from utils.redis_client import get_redis_client
 
 logger = logging.getLogger(__name__)
 
+OWNED_NUMBERS_CACHE_KEY = "twilio:owned"
+OWNED_NUMBERS_CACHE_TTL = 300  # seconds
+
+# Per-number validation results: valid numbers are cached longer than invalid ones,
+# but never longer than the owned set they were checked against.
+VALIDATION_CACHE_KEY = "twilio:valid:{number}"
+VALIDATION_LOCK_KEY = "twilio:lock:{number}"
+VALIDATION_VALID_TTL = OWNED_NUMBERS_CACHE_TTL
+VALIDATION_INVALID_TTL = 60  # seconds
+VALIDATION_LOCK_TTL = 30  # seconds
+VALIDATION_POLL_INTERVAL = 0.1  # seconds
+
 
 class _TwilioManager:
     """Manages a singleton Twilio client instance to avoid using globals."""
@@ -64,27 +80,139 @@ def send_whatsapp_message(to_number: str, body: str) -> str | None:
         return message.sid
 
 
-def validate_whatsapp_number(number: str) -> bool:
-    """Validate if a WhatsApp number exists in the Twilio account."""
-    if not number.startswith("+"):
-        number = f"+{number}"
+def _get_owned_numbers() -> frozenset[str] | None:
+    """Return the phone numbers owned by the Twilio account, cached in Redis.
+
+    Returns None if the numbers could not be fetched from Twilio.
+    """
+    redis_client = get_redis_client()
+    if redis_client:
+        try:
+            cached = redis_client.get(OWNED_NUMBERS_CACHE_KEY)
+        except redis.exceptions.RedisError:
+            logger.exception("Error reading owned Twilio numbers from cache.")
+            cached = None
+        if cached:
+            return frozenset(json.loads(cached))
 
     client = get_twilio_client()
     if not client:
-        return False
+        return None
 
     try:
         phone_numbers = client.api.accounts(
             settings.TWILIO_ACCOUNT_SID
         ).incoming_phone_numbers.list()
     except TwilioRestException:
-        logger.exception("Error validating WhatsApp number with Twilio for %s", number)
-        return False
-    else:
-        for phone in phone_numbers:
-            if phone.phone_number == number:
-                logger.info("Number %s found in Twilio account.", number)
-                return True
+        logger.exception("Error fetching owned numbers from Twilio")
+        return None
+
+    owned_numbers = frozenset(phone.phone_number for phone in phone_numbers)
+    if redis_client:
+        try:
+            redis_client.setex(
+                OWNED_NUMBERS_CACHE_KEY,
+                OWNED_NUMBERS_CACHE_TTL,
+                json.dumps(sorted(owned_numbers)),
+            )
+        except redis.exceptions.RedisError:
+            logger.exception("Error caching owned Twilio numbers.")
+    return owned_numbers
+
+
+def invalidate_owned_numbers_cache(*numbers: str) -> None:
+    """Drop the cached owned numbers, e.g. after a number is added or removed.
+
+    The cached validation results of the given numbers are dropped too, so
+    the next validation of any of them queries Twilio again.
+    """
+    redis_client = get_redis_client()
+    if not redis_client:
+        return
+    validation_keys = [
+        VALIDATION_CACHE_KEY.format(number=number if number.startswith("+") else f"+{number}")
+        for number in numbers
+    ]
+    try:
+        redis_client.delete(OWNED_NUMBERS_CACHE_KEY, *validation_keys)
+    except redis.exceptions.RedisError:
+        logger.exception("Error invalidating owned Twilio numbers cache.")
+
+
+def _check_number_with_twilio(number: str) -> bool | None:
+    """Check the number against the account's owned numbers.
+
+    Returns None if Twilio could not be queried, so the caller can tell an
+    API error apart from an unregistered number.
+    """
+    owned_numbers = _get_owned_numbers()
+    if owned_numbers is None:
+        return None
+    return number in owned_numbers
+
+
+def _validate_number_cached(number: str) -> bool | None:
+    """Validate the number through Redis, letting only one worker query Twilio.
+
+    Workers that find the lock taken poll the cache until the holder stores
+    the result, or until the lock expires.
+    """
+    redis_client = get_redis_client()
+    if not redis_client:
+        return _check_number_with_twilio(number)
+
+    cache_key = VALIDATION_CACHE_KEY.format(number=number)
+    lock_key = VALIDATION_LOCK_KEY.format(number=number)
+    deadline = time.monotonic() + VALIDATION_LOCK_TTL
+    try:
+        while True:
+            cached = redis_client.get(cache_key)
+            if cached is not None:
+                return cached == "1"
+            if redis_client.set(lock_key, "1", nx=True, ex=VALIDATION_LOCK_TTL):
+                break
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(VALIDATION_POLL_INTERVAL)
+    except redis.exceptions.RedisError:
+        logger.exception("Error reading WhatsApp validation cache for %s.", number)
+        return _check_number_with_twilio(number)
+
+    try:
+        is_valid = _check_number_with_twilio(number)
+        if is_valid is not None:
+            redis_client.setex(
+                cache_key,
+                VALIDATION_VALID_TTL if is_valid else VALIDATION_INVALID_TTL,
+                "1" if is_valid else "0",
+            )
+    except redis.exceptions.RedisError:
+        logger.exception("Error caching WhatsApp validation for %s.", number)
+    finally:
+        try:
+            redis_client.delete(lock_key)
+        except redis.exceptions.RedisError:
+            logger.exception("Error releasing WhatsApp validation lock for %s.", number)
+    return is_valid
+
+
+def validate_whatsapp_number(number: str) -> bool | None:
+    """Validate if a WhatsApp number exists in the Twilio account.
+
+    Returns None if Twilio could not be queried, so callers can report an
+    upstream error instead of an unregistered number.
+    """
+    if not number.startswith("+"):
+        number = f"+{number}"
+
+    is_valid = _validate_number_cached(number)
+    if is_valid is None:
+        logger.error("Could not validate WhatsApp number %s with Twilio", number)
+        return None
+
+    if is_valid:
+        logger.info("Number %s found in Twilio account.", number)
+        return True
 
-        logger.warning("Number %s is not registered in the Twilio account.", number)
-        return False
+    logger.warning("Number %s is not registered in the Twilio account.", number)
+    return False
@@ -1,115 +1,417 @@
 """Servicio para manejar la integración con WhatsApp Business API."""
-from datetime import UTC, datetime
-import json
+from collections.abc import Mapping
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from functools import lru_cache
+import hashlib
 import logging
-from typing import Any
-
+import re
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Final
+from urllib.parse import parse_qs, urlencode
+
+from cachetools import TLRUCache, TTLCache
+from celery_tasks import persist_outbound_event
 from extensions import db
 from flask import Flask, current_app
+from kombu.exceptions import OperationalError
+import orjson
 import requests
+from sqlalchemy import Boolean, String, case, column, func, insert, select, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, load_only
+from urllib3.util.retry import Retry
 
 from models.whatsapp_business import WhatsAppBusiness, WhatsAppMessage, WhatsAppWebhookEvent
+from utils.circuit_breaker import CircuitBreaker
+from utils.http_session import SessionManager
 
 logger = logging.getLogger(__name__)
 
+# Timeouts (conexión, lectura) para las llamadas a la Graph API.
+GRAPH_TIMEOUT: Final = (3.05, 10)
+GRAPH_API_URL: Final = "https://graph.facebook.com/v18.0"
+DEFAULT_BUSINESS_NAME: Final = "WhatsApp Business"
+# Número de destino en formato E.164 (el "+" es opcional) y longitud máxima de un texto.
+_PHONE_RE: Final = re.compile(r"^\+?[1-9]\d{6,14}$")
+MAX_TEXT_LENGTH: Final = 4096
+# Valor provisional de waba_id / phone_number_id mientras Facebook no los devuelve.
+PENDING_CONFIGURATION: Final = "pending_configuration"
+# Antigüedad máxima (segundos) de la información de WABA antes de volver a pedirla.
+WABA_INFO_MAX_AGE: Final = timedelta(days=1)
+
+OAUTH_DIALOG_URL: Final = "https://www.facebook.com/v18.0/dialog/oauth"
+OAUTH_SCOPE: Final = (
+    "whatsapp_business_management,whatsapp_business_messaging,business_management"
+)
+
+
+@lru_cache(maxsize=8)
+def _oauth_url_prefix(app_id: str | None, redirect_uri: str) -> str:
+    """Parte fija de la URL de OAuth, codificada una vez por configuración; solo `state` varía.
+
+    Se memoiza a nivel de módulo porque el servicio se instancia en cada petición.
+    """
+    return f"{OAUTH_DIALOG_URL}?" + urlencode({
+        "client_id": app_id,
+        "redirect_uri": redirect_uri,
+        "response_type": "code",
+        "scope": OAUTH_SCOPE,
+    })
+
+
+def _utc_now() -> Any:  # noqa: ANN401 - Expresión SQL
+    """Hora actual en UTC calculada por PostgreSQL, para columnas sin zona horaria."""
+    return func.timezone("utc", func.now())
+
+
+# Breaker compartido por todos los workers para las llamadas a la Graph API.
+_graph_breaker: Final = CircuitBreaker("graph", "Graph API")
+
+# Sesión compartida con graph.facebook.com: las peticiones de Flask reutilizan
+# conexiones keep-alive y sesiones TLS.
+_graph_session_manager: Final = SessionManager(
+    pool_connections=20,
+    pool_maxsize=100,
+    retry=Retry(total=3, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503, 504)),
+)
+get_graph_session = _graph_session_manager.get_session
+
+# Caché de introspección de tokens (respuesta de /debug_token), compartida entre
+# instancias del servicio. Cada entrada vive como máximo _TOKEN_CACHE_MAX_TTL
+# segundos y nunca más allá de la expiración del propio token.
+_TOKEN_CACHE_MAX_TTL: Final = 300
+_TOKEN_EXPIRY_MARGIN: Final = 30
+
+
+def _token_ttu(_key: str, token_data: dict[str, Any], now: float) -> float:
+    """Calcula cuándo expira una entrada de la caché de tokens."""
+    ttl = _TOKEN_CACHE_MAX_TTL
+    expires_at = token_data.get("expires_at") or 0
+    if expires_at:
+        ttl = min(ttl, expires_at - time.time() - _TOKEN_EXPIRY_MARGIN)
+    return now + ttl
+
+
+_token_cache: Final = TLRUCache(maxsize=4096, ttu=_token_ttu)
+_token_cache_lock: Final = threading.Lock()
+
+
+def _token_cache_key(access_token: str) -> str:
+    """Clave de tamaño fijo para no guardar el token en claro en la caché."""
+    return hashlib.blake2b(access_token.encode(), digest_size=16).hexdigest()
+
+
+def _get_cached_token_data(access_token: str) -> dict[str, Any] | None:
+    """Devuelve los datos de /debug_token cacheados para el token, si existen."""
+    with _token_cache_lock:
+        return _token_cache.get(_token_cache_key(access_token))
+
+
+def _cache_token_data(access_token: str, token_data: dict[str, Any]) -> None:
+    """Guarda los datos de /debug_token de un token."""
+    with _token_cache_lock:
+        _token_cache[_token_cache_key(access_token)] = token_data
+
+
+def invalidate_token_cache(access_token: str) -> None:
+    """Descarta la introspección cacheada de un token, p. ej. tras un 401."""
+    with _token_cache_lock:
+        _token_cache.pop(_token_cache_key(access_token), None)
+
+
+@dataclass(frozen=True, slots=True)
+class _WhatsAppAccount:
+    """Copia inmutable de los campos de WhatsAppBusiness usados al enviar y recibir.
+
+    Al no estar ligada a la sesión de SQLAlchemy puede guardarse en caché entre peticiones.
+    """
+
+    id: int
+    plubot_id: int
+    access_token: str
+    waba_id: str
+    phone_number_id: str
+    phone_number: str | None
+    # URL y cabeceras de envío, construidas una vez por cuenta en lugar de en cada mensaje
+    send_url: str
+    send_headers: Mapping[str, str]
+
+    @classmethod
+    def from_model(cls, whatsapp: WhatsAppBusiness) -> "_WhatsAppAccount":
+        """Copia los campos necesarios de una fila de WhatsAppBusiness."""
+        return cls(
+            id=whatsapp.id,
+            plubot_id=whatsapp.plubot_id,
+            access_token=whatsapp.access_token,
+            waba_id=whatsapp.waba_id,
+            phone_number_id=whatsapp.phone_number_id,
+            phone_number=whatsapp.phone_number,
+            send_url=f"{GRAPH_API_URL}/{whatsapp.phone_number_id}/messages",
+            send_headers=MappingProxyType({
+                "Authorization": f"Bearer {whatsapp.access_token}",
+                "Content-Type": "application/json",
+            }),
+        )
+
+
+# Caché en proceso de cuentas activas, para no consultar la base de datos en cada
+# mensaje enviado o recibido. Solo se guardan cuentas encontradas.
+_ACCOUNT_CACHE_TTL: Final = 60
+_accounts_by_plubot: Final = TTLCache(maxsize=2048, ttl=_ACCOUNT_CACHE_TTL)
+_accounts_by_phone_number_id: Final = TTLCache(maxsize=2048, ttl=_ACCOUNT_CACHE_TTL)
+_accounts_lock: Final = threading.RLock()
+# Solo las columnas que copia _WhatsAppAccount: el resto de la fila no se lee.
+_ACCOUNT_COLUMNS: Final = load_only(
+    WhatsAppBusiness.id,
+    WhatsAppBusiness.plubot_id,
+    WhatsAppBusiness.access_token,
+    WhatsAppBusiness.waba_id,
+    WhatsAppBusiness.phone_number_id,
+    WhatsAppBusiness.phone_number,
+)
+
+
+def _get_wa_by_plubot(plubot_id: int) -> _WhatsAppAccount | None:
+    """Devuelve la cuenta activa de un Plubot, consultando la caché antes que la base de datos."""
+    with _accounts_lock:
+        account = _accounts_by_plubot.get(plubot_id)
+    if account is not None:
+        return account
+    # Sesión propia y breve: quien envía va a esperar a la Graph API a continuación, y
+    # la conexión de db.session quedaría retenida durante toda esa llamada.
+    with Session(db.engine) as session:
+        whatsapp = session.scalars(
+            select(WhatsAppBusiness)
+            .options(_ACCOUNT_COLUMNS)
+            .filter_by(plubot_id=plubot_id, is_active=True)
+            .limit(1)
+        ).first()
+        if not whatsapp:
+            return None
+        account = _WhatsAppAccount.from_model(whatsapp)
+    with _accounts_lock:
+        _accounts_by_plubot[plubot_id] = account
+    return account
+
+
+def _get_wa_by_phone_number_ids(phone_number_ids: set[str]) -> dict[str, _WhatsAppAccount]:
+    """Devuelve las cuentas activas de varios phone_number_id con una sola consulta.
+
+    Solo se consultan los que no están en caché; los que no tienen cuenta no aparecen.
+    """
+    accounts: dict[str, _WhatsAppAccount] = {}
+    with _accounts_lock:
+        for phone_number_id in phone_number_ids:
+            account = _accounts_by_phone_number_id.get(phone_number_id)
+            if account is not None:
+                accounts[phone_number_id] = account
+    missing = phone_number_ids - accounts.keys()
+    if not missing:
+        return accounts
+    rows = WhatsAppBusiness.query.options(_ACCOUNT_COLUMNS).filter(
+        WhatsAppBusiness.phone_number_id.in_(missing),
+        WhatsAppBusiness.is_active.is_(True),
+    ).all()
+    loaded = {row.phone_number_id: _WhatsAppAccount.from_model(row) for row in rows}
+    with _accounts_lock:
+        _accounts_by_phone_number_id.update(loaded)
+    accounts.update(loaded)
+    return accounts
+
+
+def invalidate_account_cache(plubot_id: int) -> None:
+    """Descarta las cuentas cacheadas de un Plubot tras modificarlas."""
+    with _accounts_lock:
+        _accounts_by_plubot.pop(plubot_id, None)
+        stale = [
+            phone_number_id
+            for phone_number_id, account in _accounts_by_phone_number_id.items()
+            if account.plubot_id == plubot_id
+        ]
+        for phone_number_id in stale:
+            _accounts_by_phone_number_id.pop(phone_number_id, None)
+
 
 class WhatsAppBusinessService:
     """Servicio para manejar operaciones con WhatsApp Business API."""
 
-    BASE_URL = "https://graph.facebook.com/v18.0"
+    BASE_URL = GRAPH_API_URL
+    # Clave en app.extensions de la instancia compartida (ver for_app)
+    EXTENSION_KEY = "wa_business_service"
+
+    __slots__ = (
+        "_session",
+        "app",
+        "app_id",
+        "app_secret",
+        "redirect_uri",
+        "webhook_verify_token",
+    )
 
     def __init__(self, app: Flask | None = None) -> None:
         """Inicializa el servicio con la configuración de la aplicación."""
-        self.app = app or current_app
+        self.app = app or current_app._get_current_object()  # noqa: SLF001
         self.app_id = self.app.config.get("FACEBOOK_APP_ID")
         self.app_secret = self.app.config.get("FACEBOOK_APP_SECRET")
         self.webhook_verify_token = self.app.config.get("WHATSAPP_WEBHOOK_VERIFY_TOKEN")
         # Usar la página de callback del frontend
         self.redirect_uri = "https://plubot.com/whatsapp-callback.html"
+        # Se publica en app.extensions para poder sustituirla (p. ej. en pruebas)
+        self._session = self.app.extensions.setdefault("wa_session", get_graph_session())
+
+    @classmethod
+    def for_app(cls, app: Flask | None = None) -> "WhatsAppBusinessService":
+        """Devuelve la instancia registrada en la app, creándola en el primer uso.
+
+        El servicio no guarda estado por petición, así que se comparte una sola
+        instancia por aplicación en lugar de releer la configuración cada vez.
+        """
+        app = app or current_app._get_current_object()  # noqa: SLF001
+        service = app.extensions.get(cls.EXTENSION_KEY)
+        if service is None:
+            service = cls(app)
+            app.extensions[cls.EXTENSION_KEY] = service
+        return service
 
     def get_oauth_url(self, plubot_id: int) -> str:
         """Genera la URL de OAuth para conectar WhatsApp Business."""
-        import urllib.parse
-
-        # URL base de Facebook OAuth
-        base_url = "https://www.facebook.com/v18.0/dialog/oauth"
-
-        # Parámetros de OAuth
-        params = {
-            "client_id": self.app_id,
-            "redirect_uri": self.redirect_uri,
-            "state": str(plubot_id),
-            "response_type": "code",
-            "scope": "whatsapp_business_management,whatsapp_business_messaging,business_management"
-        }
-
-        # Construir URL con parámetros codificados
-        oauth_url = f"{base_url}?{urllib.parse.urlencode(params)}"
-        logger.info("OAuth URL generada para Plubot %s: %s", plubot_id, oauth_url)
+        # plubot_id es un entero, así que no necesita codificarse
+        oauth_url = f"{_oauth_url_prefix(self.app_id, self.redirect_uri)}&state={plubot_id}"
+        logger.debug("OAuth URL generada para Plubot %s", plubot_id)
 
         return oauth_url
 
-    def _extract_token_from_response(self, response_text: str) -> str | None:
-        """Extrae el token de la respuesta de Facebook."""
+    @staticmethod
+    def _extract_token_from_response(response_text: str, content_type: str) -> str | None:
+        """Extrae el token de la respuesta de Facebook.
+
+        Graph responde con JSON; las versiones antiguas del endpoint devuelven un
+        query string. Se elige el parser por el Content-Type en lugar de provocar
+        una excepción en cada respuesta que no es JSON.
+        """
+        if "json" in content_type:
+            try:
+                token_data = orjson.loads(response_text)
+            except ValueError:
+                logger.warning("Respuesta de token marcada como JSON pero no es válida")
+            else:
+                if isinstance(token_data, dict):
+                    return token_data.get("access_token")
+                return None
+        parsed = parse_qs(response_text)
+        return parsed.get("access_token", [None])[0]
+
+    def _graph_call(
+        self,
+        method: str,
+        url: str,
+        **kwargs: Any,  # noqa: ANN401 - Se reenvían tal cual a requests
+    ) -> requests.Response | None:
+        """Llama a la Graph API a través del circuit breaker.
+
+        Devuelve None sin hacer la petición si el breaker está abierto, o si la
+        conexión falla o expira (lo que cuenta como fallo para el breaker).
+        """
+        if _graph_breaker.is_open():
+            logger.warning("Graph API en pausa por el circuit breaker; se omite %s", url)
+            return None
         try:
-            token_data = json.loads(response_text)
-            return token_data.get("access_token")
-        except (ValueError, KeyError):
-            # Si no es JSON, intentar parsear como query string
-            from urllib.parse import parse_qs
-            parsed = parse_qs(response_text)
-            return parsed.get("access_token", [None])[0]
+            return self._session.request(method, url, timeout=GRAPH_TIMEOUT, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            logger.exception("No se pudo conectar con la Graph API: %s", url)
+            _graph_breaker.record_failure()
+            return None
+
+    @staticmethod
+    def _json_or_none(response: requests.Response | None) -> dict[str, Any] | None:
+        """Devuelve el JSON de una respuesta de la Graph API, o None si no fue 200."""
+        if response is None or response.status_code != 200:
+            return None
+        return orjson.loads(response.content)
+
+    def _debug_token_params(self, access_token: str) -> dict[str, str]:
+        """Parámetros para introspeccionar un token con el token de la app."""
+        return {
+            "input_token": access_token,
+            "access_token": f"{self.app_id}|{self.app_secret}"
+        }
+
+    @staticmethod
+    def _first_waba(
+        token_data: dict[str, Any] | None, wabas_data: dict[str, Any] | None
+    ) -> dict[str, Any] | None:
+        """Devuelve el primer WABA de la lista si el token es válido, o None."""
+        if not token_data or not token_data.get("is_valid"):
+            return None
+        if not wabas_data or not wabas_data.get("data"):
+            return None
+        return wabas_data["data"][0]
+
+    @staticmethod
+    def _first_phone(phones_data: dict[str, Any] | None) -> tuple[str | None, str | None]:
+        """Devuelve (phone_number_id, phone_number) del primer número del WABA."""
+        if not phones_data or not phones_data.get("data"):
+            return None, None
+        first_phone = phones_data["data"][0]
+        return first_phone.get("id"), first_phone.get("display_phone_number")
 
     def _get_waba_info(self, access_token: str) -> tuple[str | None, str | None, str | None, str]:
         """Obtiene información del WhatsApp Business Account."""
         waba_id = None
         phone_number_id = None
         phone_number = None
-        business_name = "WhatsApp Business"
+        business_name = DEFAULT_BUSINESS_NAME
 
         try:
-            # Obtener información del token
-            debug_url = "https://graph.facebook.com/v18.0/debug_token"
-            debug_params = {
-                "input_token": access_token,
-                "access_token": f"{self.app_id}|{self.app_secret}"
-            }
-            debug_response = requests.get(debug_url, params=debug_params, timeout=30)
-
-            if debug_response.status_code == 200:
-                debug_data = debug_response.json()
-                if debug_data.get("data", {}).get("is_valid"):
-                    # Obtener WABAs
-                    user_id = debug_data["data"].get("user_id")
-                    if user_id:
-                        wabas_url = f"{self.BASE_URL}/{user_id}/owned_whatsapp_business_accounts"
-                        wabas_response = requests.get(
-                            wabas_url,
-                            params={"access_token": access_token},
-                            timeout=30
-                        )
-
-                        if wabas_response.status_code == 200:
-                            wabas_data = wabas_response.json()
-                            if wabas_data.get("data"):
-                                first_waba = wabas_data["data"][0]
-                                waba_id = first_waba.get("id")
-                                business_name = first_waba.get("name", "WhatsApp Business")
-
-                                # Obtener phone numbers
-                                phones_url = f"{self.BASE_URL}/{waba_id}/phone_numbers"
-                                phones_response = requests.get(
-                                    phones_url,
-                                    params={"access_token": access_token},
-                                    timeout=30
-                                )
-
-                                if phones_response.status_code == 200:
-                                    phones_data = phones_response.json()
-                                    if phones_data.get("data"):
-                                        first_phone = phones_data["data"][0]
-                                        phone_number_id = first_phone.get("id")
-                                        phone_number = first_phone.get("display_phone_number")
+            token_data = _get_cached_token_data(access_token)
+            if token_data is None:
+                debug_data = self._json_or_none(
+                    self._graph_call(
+                        "GET",
+                        f"{self.BASE_URL}/debug_token",
+                        params=self._debug_token_params(access_token),
+                    )
+                )
+                if debug_data:
+                    token_data = debug_data.get("data", {})
+                    _cache_token_data(access_token, token_data)
+
+            # Los WABAs se piden al usuario dueño del token, que da /debug_token
+            is_valid = bool(token_data and token_data.get("is_valid"))
+            user_id = token_data.get("user_id") if is_valid else None
+            if not user_id:
+                return waba_id, phone_number_id, phone_number, business_name
+            wabas_data = self._json_or_none(
+                self._graph_call(
+                    "GET",
+                    f"{self.BASE_URL}/{user_id}/owned_whatsapp_business_accounts",
+                    params={"access_token": access_token},
+                )
+            )
+
+            first_waba = self._first_waba(token_data, wabas_data)
+            if first_waba is None:
+                return waba_id, phone_number_id, phone_number, business_name
+            waba_id = first_waba.get("id")
+            business_name = first_waba.get("name", DEFAULT_BUSINESS_NAME)
+
+            # Obtener phone numbers
+            phones_response = self._graph_call(
+                "GET",
+                f"{self.BASE_URL}/{waba_id}/phone_numbers",
+                params={"access_token": access_token},
+            )
+            status_code = phones_response.status_code if phones_response is not None else None
+            if status_code == 401:
+                invalidate_token_cache(access_token)
+            elif status_code == 200:
+                phone_number_id, phone_number = self._first_phone(
+                    orjson.loads(phones_response.content)
+                )
         except (ValueError, KeyError, TypeError):
             logger.exception("Error obteniendo información de WABA")
 
@@ -128,103 +430,196 @@ class WhatsAppBusinessService:
             }
 
             logger.info("Intercambiando código por token para Plubot %s", plubot_id)
-            logger.info("URL: %s", token_url)
-            logger.info("Client ID: %s...", self.app_id[:10])
-            logger.info("Redirect URI: %s", self.redirect_uri)
+            logger.debug("Redirect URI: %s", self.redirect_uri)
 
-            response = requests.post(token_url, params=params, timeout=30)
+            response = self._graph_call("POST", token_url, params=params)
+            if response is None:
+                return False
 
-            logger.info("Response status: %s", response.status_code)
-            logger.info("Response text: %s", response.text[:500])
+            # El cuerpo de una respuesta correcta contiene el access_token: nunca se registra.
+            logger.debug("Response status: %s", response.status_code)
 
             if response.status_code != 200:
                 logger.error(
-                    "Error enviando mensaje: Status %s, Response: %s",
-                    response.status_code, response.text
+                    "Error intercambiando el código: Status %s, x-fb-trace-id: %s",
+                    response.status_code, response.headers.get("x-fb-trace-id")
                 )
+                # El cuerpo solo se decodifica si de verdad se va a registrar
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Respuesta del intercambio: %s", response.text[:500])
                 return False
 
             # Extraer token de la respuesta
-            access_token = self._extract_token_from_response(response.text)
+            access_token = self._extract_token_from_response(
+                response.text, response.headers.get("Content-Type", "")
+            )
             if not access_token:
-                logger.error("No se pudo extraer access_token de la respuesta: %s", response.text)
+                logger.error(
+                    "No se pudo extraer access_token de la respuesta para Plubot %s", plubot_id
+                )
                 return False
 
-            logger.info("Procesando webhook para Plubot %s", plubot_id)
+            logger.debug("Obteniendo información de WABA para Plubot %s", plubot_id)
 
             # Obtener información del negocio de WhatsApp
             waba_id, phone_number_id, phone_number, business_name = self._get_waba_info(
                 access_token
             )
 
-            # Si no se obtuvieron los datos, usar valores por defecto
-            if not waba_id:
-                waba_id = "pending_configuration"
-            if not phone_number_id:
-                phone_number_id = "pending_configuration"
-            if not phone_number:
-                phone_number = "pending_configuration"
-
-            whatsapp = db.session.query(WhatsAppBusiness).filter_by(plubot_id=plubot_id).first()
-
-            if whatsapp:
-                # Actualizar cuenta existente
-                whatsapp.access_token = access_token
-                whatsapp.waba_id = waba_id
-                whatsapp.phone_number_id = phone_number_id
-                whatsapp.phone_number = phone_number
-                whatsapp.business_name = business_name
-                whatsapp.is_active = True
-                whatsapp.updated_at = datetime.now(UTC)
-                logger.info("Actualizando WhatsApp Business existente para Plubot %s", plubot_id)
-            else:
-                # Usar SQL directo para evitar problemas de metadata
+            self._save_account(
+                plubot_id, access_token, waba_id, phone_number_id, phone_number, business_name
+            )
+            logger.info("WhatsApp Business conectado exitosamente para Plubot %s", plubot_id)
+
+        except SQLAlchemyError:
+            logger.exception("Error de base de datos en exchange_token")
+            db.session.rollback()
+            return False
+        except (ValueError, KeyError, TypeError):
+            logger.exception("Error en exchange_token")
+            return False
+        else:
+            return True
 
-                # Crear nuevo registro de WhatsApp Business
+    def _save_account(
+        self,
+        plubot_id: int,
+        access_token: str,
+        waba_id: str | None,
+        phone_number_id: str | None,
+        phone_number: str | None,
+        business_name: str,
+    ) -> None:
+        """Crea o actualiza la cuenta de WhatsApp Business del Plubot y confirma."""
+        # Si no se obtuvieron los datos, usar valores por defecto
+        if not waba_id:
+            waba_id = PENDING_CONFIGURATION
+        if not phone_number_id:
+            phone_number_id = PENDING_CONFIGURATION
+        if not phone_number:
+            phone_number = PENDING_CONFIGURATION
+
+        # Un único INSERT ... ON CONFLICT evita la lectura previa y la carrera
+        # entre callbacks concurrentes (plubot_id tiene un índice único).
+        stmt = pg_insert(WhatsAppBusiness).values(
+            plubot_id=plubot_id,
+            access_token=access_token,
+            waba_id=waba_id,
+            phone_number_id=phone_number_id,
+            phone_number=phone_number,
+            business_name=business_name,
+            is_active=True,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[WhatsAppBusiness.plubot_id],
+            set_={
+                "access_token": stmt.excluded.access_token,
+                "waba_id": stmt.excluded.waba_id,
+                "phone_number_id": stmt.excluded.phone_number_id,
+                "phone_number": stmt.excluded.phone_number,
+                "business_name": stmt.excluded.business_name,
+                "is_active": True,
+                "updated_at": _utc_now(),
+            },
+        )
+        db.session.execute(stmt)
+        logger.debug("Guardando WhatsApp Business para Plubot %s", plubot_id)
+
+        db.session.commit()
+        invalidate_account_cache(plubot_id)
+
+    def update_whatsapp_info(self, plubot_id: int) -> _WhatsAppAccount | None:
+        """Completa waba_id y phone_number_id de la cuenta a partir de su token.
+
+        No llama a la Graph API si la cuenta ya está configurada y se actualizó
+        hace menos de WABA_INFO_MAX_AGE. Devuelve la cuenta ya actualizada (y la
+        deja en caché) para que quien envía no tenga que volver a leerla, o None
+        si no se pudo completar.
+        """
+        try:
+            # La fila se lee en una sesión breve para no retener una conexión durante
+            # las llamadas a la Graph API; la actualización va en su propia transacción.
+            with Session(db.engine) as session:
+                whatsapp = session.scalars(
+                    select(WhatsAppBusiness)
+                    .filter_by(plubot_id=plubot_id, is_active=True)
+                    .limit(1)
+                ).first()
+            if not whatsapp or not whatsapp.access_token:
+                return None
+
+            # updated_at se guarda en UTC sin zona horaria; sin fecha se considera antigua
+            is_fresh = (
+                whatsapp.updated_at is not None
+                and datetime.now(UTC).replace(tzinfo=None) - whatsapp.updated_at
+                < WABA_INFO_MAX_AGE
+            )
+            if (
+                whatsapp.waba_id not in (None, PENDING_CONFIGURATION)
+                and whatsapp.phone_number_id not in (None, PENDING_CONFIGURATION)
+                and is_fresh
+            ):
+                return _WhatsAppAccount.from_model(whatsapp)
+
+            waba_id, phone_number_id, phone_number, business_name = self._get_waba_info(
+                whatsapp.access_token
+            )
+            if not waba_id or not phone_number_id:
+                logger.warning("Facebook no devolvió el WABA del Plubot %s", plubot_id)
+                return None
 
-                whatsapp = WhatsAppBusiness(
-                    plubot_id=plubot_id,
-                    access_token=access_token,
+            db.session.execute(
+                update(WhatsAppBusiness)
+                .where(WhatsAppBusiness.id == whatsapp.id)
+                .values(
                     waba_id=waba_id,
                     phone_number_id=phone_number_id,
                     phone_number=phone_number,
                     business_name=business_name,
-                    is_active=True,
-                    created_at=datetime.now(UTC),
-                    updated_at=datetime.now(UTC)
                 )
-                db.session.add(whatsapp)
-
-                logger.info("Creando nuevo WhatsApp Business para Plubot %s", plubot_id)
-
+            )
             db.session.commit()
-            logger.info("WhatsApp Business conectado exitosamente para Plubot %s", plubot_id)
+            logger.info("Información de WhatsApp Business actualizada para Plubot %s", plubot_id)
 
-        except (ValueError, KeyError, TypeError):
-            logger.exception("Error en exchange_token")
+            # La fila leída ya no está ligada a ninguna sesión: se completa en memoria
+            whatsapp.waba_id = waba_id
+            whatsapp.phone_number_id = phone_number_id
+            whatsapp.phone_number = phone_number
+            account = _WhatsAppAccount.from_model(whatsapp)
+            invalidate_account_cache(plubot_id)
+            with _accounts_lock:
+                _accounts_by_plubot[plubot_id] = account
+
+        except SQLAlchemyError:
+            logger.exception("Error de base de datos actualizando la información de WhatsApp")
             db.session.rollback()
-            return False
+            return None
+        except (ValueError, KeyError, TypeError):
+            logger.exception("Error actualizando la información de WhatsApp")
+            return None
         else:
-            return True
+            return account
 
     def verify_token(self, access_token: str) -> bool:
         """Verifica si un token de acceso es válido."""
         try:
-            debug_url = f"{self.graph_url}/debug_token"
-            params = {
-                "input_token": access_token,
-                "access_token": f"{self.app_id}|{self.app_secret}"
-            }
-
-            response = requests.get(debug_url, params=params, timeout=30)
-            if response.status_code == 200:
-                data = response.json().get("data", {})
+            data = _get_cached_token_data(access_token)
+            if data is None:
+                response = self._graph_call(
+                    "GET",
+                    f"{self.BASE_URL}/debug_token",
+                    params=self._debug_token_params(access_token),
+                )
+                if response is not None and response.status_code == 200:
+                    data = orjson.loads(response.content).get("data", {})
+                    _cache_token_data(access_token, data)
+            if data is not None:
                 if data.get("is_valid"):
                     logger.info("Token válido para WhatsApp Business")
                     return True
                 logger.warning("Token inválido para WhatsApp Business")
                 return False
-        except requests.exceptions.RequestException:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError):
             logger.exception("Error verificando token de WhatsApp Business")
             return False
         else:
@@ -233,20 +628,25 @@ class WhatsAppBusinessService:
     def disconnect(self, plubot_id: int) -> bool:
         """Desconecta WhatsApp Business de un Plubot."""
         try:
-            whatsapp = db.session.query(WhatsAppBusiness).filter_by(plubot_id=plubot_id).first()
-
-            if not whatsapp:
+            # Marcar como inactiva con un UPDATE directo, sin cargar la fila;
+            # updated_at lo actualiza la base de datos (onupdate del modelo)
+            access_token = db.session.scalar(
+                update(WhatsAppBusiness)
+                .where(WhatsAppBusiness.plubot_id == plubot_id)
+                .values(is_active=False)
+                .returning(WhatsAppBusiness.access_token)
+            )
+            if access_token is None:
+                db.session.rollback()
                 logger.warning("No se encontró cuenta de WhatsApp para Plubot %s", plubot_id)
                 return False
 
-            # Marcar como inactiva
-            whatsapp.is_active = False
-            whatsapp.updated_at = datetime.now(UTC)
-
             db.session.commit()
+            invalidate_account_cache(plubot_id)
+            invalidate_token_cache(access_token)
             logger.info("Información de WhatsApp Business actualizada para Plubot %s", plubot_id)
 
-        except (ValueError, KeyError, TypeError):
+        except SQLAlchemyError:
             logger.exception("Error desconectando WhatsApp")
             db.session.rollback()
             return False
@@ -254,13 +654,17 @@ class WhatsAppBusinessService:
             return True
 
     def send_message(
-        self, plubot_id: int, to: str, message: str, message_type: str = "text"
+        self, plubot_id: int, to: str, message: str | dict[str, Any], message_type: str = "text"
     ) -> str | None:
-        """Envía un mensaje de WhatsApp."""
+        """Envía un mensaje de WhatsApp.
+
+        Para los tipos distintos de "text", `message` es el ID de un medio (str)
+        o el objeto del tipo tal como lo espera la Graph API (dict).
+        """
+        if not self._is_sendable(to, message, message_type):
+            return None
         try:
-            whatsapp = db.session.query(WhatsAppBusiness).filter_by(
-                plubot_id=plubot_id, is_active=True
-            ).first()
+            whatsapp = _get_wa_by_plubot(plubot_id)
 
             if not whatsapp:
                 logger.warning(
@@ -269,7 +673,7 @@ class WhatsAppBusinessService:
                 return None
 
             # Verificar que tenemos la configuración necesaria
-            if not whatsapp.phone_number_id or whatsapp.phone_number_id == "pending_configuration":
+            if not whatsapp.phone_number_id or whatsapp.phone_number_id == PENDING_CONFIGURATION:
                 logger.error(
                     "WhatsApp no está completamente configurado para Plubot %s",
                     plubot_id
@@ -280,89 +684,162 @@ class WhatsAppBusinessService:
                     whatsapp.waba_id
                 )
                 # Intentar usar el token para obtener la información faltante
-                if whatsapp.access_token:
-                    self.update_whatsapp_info(plubot_id)
-                    # Recargar la información
-                    db.session.refresh(whatsapp)
-                    if (
-                        not whatsapp.phone_number_id
-                        or whatsapp.phone_number_id == "pending_configuration"
-                    ):
-                        return None
-                else:
+                if not whatsapp.access_token:
+                    return None
+                # update_whatsapp_info devuelve la cuenta actualizada: no hace falta releerla
+                whatsapp = self.update_whatsapp_info(plubot_id)
+                if (
+                    not whatsapp
+                    or not whatsapp.phone_number_id
+                    or whatsapp.phone_number_id == PENDING_CONFIGURATION
+                ):
                     return None
 
-            # Construir el mensaje según el tipo
-            if message_type == "text":
-                payload = {
-                    "messaging_product": "whatsapp",
-                    "to": to,
-                    "type": "text",
-                    "text": {"body": message}
-                }
-            else:
-                # Aquí se pueden agregar otros tipos de mensajes
-                payload = {
-                    "messaging_product": "whatsapp",
-                    "to": to,
-                    "type": message_type,
-                    message_type: message
-                }
+            payload = self._build_message_payload(to, message, message_type)
 
             # Enviar mensaje
-            url = (
-                f"https://graph.facebook.com/v18.0/"
-                f"{whatsapp.phone_number_id}/messages"
-            )
-            headers = {
-                "Authorization": f"Bearer {whatsapp.access_token}",
-                "Content-Type": "application/json"
-            }
-
-            response = requests.post(
-                url, headers=headers, json=payload, timeout=30
+            response = self._graph_call(
+                "POST",
+                whatsapp.send_url,
+                headers=whatsapp.send_headers,
+                data=orjson.dumps(payload),
             )
+            if response is None:
+                return None
+            if response.status_code == 401:
+                invalidate_token_cache(whatsapp.access_token)
 
             if response.status_code == 200:
-                result = response.json()
+                result = orjson.loads(response.content)
                 message_id = result.get("messages", [{}])[0].get("id")
                 logger.info("Mensaje enviado exitosamente. ID: %s", message_id)
 
-                # Guardar mensaje en la base de datos
-                wa_message = WhatsAppMessage(
-                    whatsapp_business_id=whatsapp.id,
-                    message_id=message_id,
-                    from_number=whatsapp.phone_number,
-                    to_number=to,
-                    message_type=message_type,
-                    content=(
-                        message if message_type == "text" else json.dumps(message)
-                    ),
-                    is_inbound=False,
-                    status="sent"
+                self._record_sent_message(
+                    whatsapp,
+                    to,
+                    message,
+                    message_type,
+                    message_id,
+                    {"value": result, "message": payload},
                 )
-                db.session.add(wa_message)
-
-                # Guardar evento del webhook
-                webhook_event = WhatsAppWebhookEvent(
-                    whatsapp_business_id=whatsapp.id,
-                    event_type="message",
-                    event_data={"value": {}, "message": {}}
-                )
-                db.session.add(webhook_event)
-
-                db.session.commit()
-                logger.info("Mensaje enviado y guardado exitosamente")
                 return message_id
 
+        except SQLAlchemyError:
+            logger.exception("Error de base de datos guardando el mensaje enviado")
+            db.session.rollback()
+            return None
         except (ValueError, KeyError, TypeError):
             logger.exception("Error enviando mensaje")
-            db.session.rollback()
             return None
         else:
             logger.error("Error enviando mensaje: %s", response.text)
             return None
 
+    @staticmethod
+    def _is_sendable(to: str, message: str | dict[str, Any], message_type: str) -> bool:
+        """Descarta destinos o textos que la Graph API rechazaría, sin llamarla."""
+        if not to or not _PHONE_RE.match(to):
+            logger.warning("Número de destino inválido: %s", to)
+            return False
+        if message_type == "text" and not 0 < len(message or "") <= MAX_TEXT_LENGTH:
+            logger.warning("Texto vacío o de más de %s caracteres para %s", MAX_TEXT_LENGTH, to)
+            return False
+        return True
+
+    @staticmethod
+    def _build_message_payload(
+        to: str, message: str | dict[str, Any], message_type: str
+    ) -> dict[str, Any]:
+        """Construye el cuerpo de la petición de envío según el tipo de mensaje."""
+        if message_type == "text":
+            return {
+                "messaging_product": "whatsapp",
+                "to": to,
+                "type": "text",
+                "text": {"body": message}
+            }
+        # Aquí se pueden agregar otros tipos de mensajes
+        return {
+            "messaging_product": "whatsapp",
+            "to": to,
+            "type": message_type,
+            message_type: message
+        }
+
+    @classmethod
+    def _record_sent_message(
+        cls,
+        whatsapp: _WhatsAppAccount,
+        to: str,
+        message: str | dict[str, Any],
+        message_type: str,
+        message_id: str,
+        event_data: dict[str, Any],
+    ) -> None:
+        """Guarda el mensaje enviado y encola su evento.
+
+        La fila del mensaje se escribe antes de devolver el ID porque Meta puede
+        enviar los webhooks de estado en cuanto acepta el envío, y el UPDATE de
+        estados debe encontrarla. Solo el evento va a la cola; si no está
+        disponible, se guarda en línea.
+        """
+        # Un ID de medio ya es un str: solo los objetos (dict) se serializan
+        content = message if isinstance(message, str) else orjson.dumps(message).decode()
+        if not cls._save_sent_message(whatsapp, to, content, message_type, message_id):
+            return
+        try:
+            persist_outbound_event.delay(whatsapp.id, event_data)
+        except OperationalError:
+            logger.exception("Cola no disponible; guardando el evento de %s en línea", message_id)
+            db.session.add(
+                WhatsAppWebhookEvent(
+                    whatsapp_business_id=whatsapp.id,
+                    event_type="message",
+                    event_data=event_data,
+                )
+            )
+            db.session.commit()
+
+    @classmethod
+    def _save_sent_message(
+        cls,
+        whatsapp: _WhatsAppAccount,
+        to: str,
+        content: str,
+        message_type: str,
+        message_id: str,
+    ) -> bool:
+        """Guarda el mensaje enviado y confirma; devuelve False si ya estaba guardado."""
+        inserted_ids = cls._insert_new_messages([{
+            "whatsapp_business_id": whatsapp.id,
+            "message_id": message_id,
+            "from_number": whatsapp.phone_number,
+            "to_number": to,
+            "message_type": message_type,
+            "content": content,
+            "is_inbound": False,
+            "status": "sent",
+        }])
+        db.session.commit()
+        return message_id in inserted_ids
+
+    @staticmethod
+    def _insert_new_messages(message_rows: list[dict[str, Any]]) -> set[str]:
+        """Inserta los mensajes en bloque y devuelve los message_id que eran nuevos.
+
+        Un message_id ya guardado se ignora (ON CONFLICT DO NOTHING sobre su
+        índice único): Facebook reintenta los webhooks y un envío puede
+        registrarse dos veces.
+        """
+        return set(
+            db.session.scalars(
+                pg_insert(WhatsAppMessage)
+                .on_conflict_do_nothing(index_elements=[WhatsAppMessage.message_id])
+                .returning(WhatsAppMessage.message_id),
+                message_rows,
+            )
+        )
+
     def verify_webhook(self, mode: str, token: str, challenge: str) -> str | None:
         """Verifica el webhook de WhatsApp."""
         if mode == "subscribe" and token == self.webhook_verify_token:
@@ -371,107 +848,173 @@ class WhatsAppBusinessService:
         logger.warning("Verificación de webhook con token incorrecto: %s", token)
         return None
 
-    def process_webhook(self, data: dict[str, Any]) -> None:
-        """Procesa los eventos del webhook de WhatsApp."""
+    def process_webhook(self, data: dict[str, Any]) -> bool:
+        """Procesa los eventos del webhook de WhatsApp.
+
+        Todos los mensajes y eventos de una llamada al webhook se insertan en
+        bloque (ignorando los ya recibidos), los estados se aplican con un único
+        UPDATE y todo se confirma en una sola transacción. Devuelve False si la
+        base de datos falló y el lote se revirtió, para que la tarea que lo
+        procesa pueda reintentarlo.
+        """
+        messages_to_insert: list[dict[str, Any]] = []
+        events_to_insert: list[dict[str, Any]] = []
+        status_rows: dict[str, dict[str, Any]] = {}
         try:
-            entry = data.get("entry", [])
-
-            for item in entry:
-                changes = item.get("changes", [])
-
-                for change in changes:
+            # Primera pasada: agrupar los cambios con mensajes y acumular los estados
+            message_values: list[tuple[str | None, dict[str, Any]]] = []
+            for item in data.get("entry", []):
+                for change in item.get("changes", []):
                     value = change.get("value", {})
-
-                    # Procesar mensajes
-                    messages = value.get("messages", [])
-                    for message in messages:
-                        self._process_message(value, message)
-
-                    # Procesar estados de mensajes
-                    statuses = value.get("statuses", [])
-                    for status in statuses:
-                        self._process_status(value, status)
-
-        except Exception:
-            logger.exception("Error procesando webhook")
-
-    def _process_message(self, value: dict[str, Any], message: dict[str, Any]) -> None:
-        """Procesa un mensaje recibido."""
-        try:
-            phone_number_id = value.get("metadata", {}).get("phone_number_id")
-
-            # Buscar la cuenta de WhatsApp correspondiente
-            whatsapp = WhatsAppBusiness.query.filter_by(
-                phone_number_id=phone_number_id,
-                is_active=True
-            ).first()
-
-            if not whatsapp:
-                logger.warning("No se encontró cuenta para phone_number_id: %s", phone_number_id)
-                return
-
-            # Extraer información del mensaje
-            from_number = message.get("from")
-            message_id = message.get("id")
-            message_type = message.get("type", "text")
-
-            # Extraer contenido según el tipo
-            content = None
-            if message_type == "text":
-                content = message.get("text", {}).get("body")
-            elif message_type == "image":
-                content = message.get("image", {}).get("id")
-            # Agregar más tipos según sea necesario
-
-            # Guardar mensaje en la base de datos
-            wa_message = WhatsAppMessage(
-                whatsapp_business_id=whatsapp.id,
-                message_id=message_id,
-                from_number=from_number,
-                to_number=whatsapp.phone_number,
-                message_type=message_type,
-                content=content,
-                is_inbound=True,
-                status="received",
-                message_metadata=message
+                    if value.get("messages"):
+                        phone_number_id = value.get("metadata", {}).get("phone_number_id")
+                        message_values.append((phone_number_id, value))
+                    # Los estados se aplican al final, tras insertar los mensajes del lote
+                    for status in value.get("statuses", []):
+                        self._collect_status(status_rows, status)
+
+            # Todas las cuentas del lote se cargan con una sola consulta
+            accounts = _get_wa_by_phone_number_ids(
+                {phone_number_id for phone_number_id, _ in message_values if phone_number_id}
             )
-            db.session.add(wa_message)
+            for phone_number_id, value in message_values:
+                whatsapp = accounts.get(phone_number_id)
+                if not whatsapp:
+                    logger.warning(
+                        "No se encontró cuenta para phone_number_id: %s", phone_number_id
+                    )
+                    continue
+                for message in value["messages"]:
+                    message_row, event_row = self._build_message_rows(whatsapp, value, message)
+                    messages_to_insert.append(message_row)
+                    events_to_insert.append(event_row)
+
+            if messages_to_insert:
+                self._insert_messages(messages_to_insert, events_to_insert)
+
+            # Procesar estados de mensajes, después de insertar los mensajes del lote
+            if status_rows:
+                self._apply_statuses(list(status_rows.values()))
 
-            # Guardar evento del webhook
-            webhook_event = WhatsAppWebhookEvent(
-                whatsapp_business_id=whatsapp.id,
-                event_type="message",
-                event_data={"value": value, "message": message}
-            )
-            db.session.add(webhook_event)
             db.session.commit()
-
             # TODO: Procesar con el motor de flujos cuando esté disponible
 
-        except (ValueError, KeyError, TypeError):
-            logger.exception("Error procesando mensaje")
+        except SQLAlchemyError:
+            logger.exception("Error de base de datos procesando webhook")
             db.session.rollback()
+            return False
+        except (ValueError, KeyError, TypeError, AttributeError):
+            # El formato se valida antes de escribir nada: reintentar no serviría
+            logger.exception("Webhook con formato inesperado")
+            return True
+        else:
+            return True
 
-    def _process_status(self, _value: dict[str, Any], status: dict[str, Any]) -> None:
-        """Procesa una actualización de estado de mensaje."""
-        try:
-            message_id = status.get("id")
-            status_type = status.get("status")
-
-            # Actualizar el estado del mensaje en la base de datos
-            wa_message = WhatsAppMessage.query.filter_by(message_id=message_id).first()
-
-            if wa_message:
-                wa_message.status = status_type
-
-                if status_type == "delivered":
-                    wa_message.delivered_at = datetime.now(UTC)
-                elif status_type == "read":
-                    wa_message.read_at = datetime.now(UTC)
-
-                db.session.commit()
-                logger.info("Estado de mensaje actualizado: %s - %s", message_id, status_type)
-
-        except (ValueError, KeyError, TypeError):
-            logger.exception("Error procesando estado")
-            db.session.rollback()
+    @classmethod
+    def _insert_messages(
+        cls, message_rows: list[dict[str, Any]], event_rows: list[dict[str, Any]]
+    ) -> None:
+        """Inserta en bloque los mensajes recibidos y los eventos de los que son nuevos.
+
+        Un mensaje que Facebook reenvía no aborta el lote: se ignora y su evento no
+        se vuelve a insertar.
+        """
+        inserted_ids = cls._insert_new_messages(message_rows)
+        new_events = [
+            event_row
+            for message_row, event_row in zip(message_rows, event_rows, strict=True)
+            if message_row["message_id"] in inserted_ids
+        ]
+        if new_events:
+            db.session.execute(insert(WhatsAppWebhookEvent), new_events)
+
+    def _build_message_rows(
+        self, whatsapp: _WhatsAppAccount, value: dict[str, Any], message: dict[str, Any]
+    ) -> tuple[dict[str, Any], dict[str, Any]]:
+        """Construye las filas del mensaje recibido y de su evento de webhook."""
+        # Extraer información del mensaje
+        message_type = message.get("type", "text")
+
+        # Extraer contenido según el tipo
+        content = None
+        if message_type == "text":
+            content = message.get("text", {}).get("body")
+        elif message_type == "image":
+            content = message.get("image", {}).get("id")
+        # Agregar más tipos según sea necesario
+
+        message_row = {
+            "whatsapp_business_id": whatsapp.id,
+            "message_id": message.get("id"),
+            "from_number": message.get("from"),
+            "to_number": whatsapp.phone_number,
+            "message_type": message_type,
+            "content": content,
+            "is_inbound": True,
+            "status": "received",
+            # El mensaje completo ya queda en event_data: aquí solo lo que no está en columnas
+            "message_metadata": {"type": message_type, "timestamp": message.get("timestamp")},
+        }
+        event_row = {
+            "whatsapp_business_id": whatsapp.id,
+            "event_type": "message",
+            "event_data": {"value": value, "message": message},
+        }
+        return message_row, event_row
+
+    @staticmethod
+    def _collect_status(status_rows: dict[str, dict[str, Any]], status: dict[str, Any]) -> None:
+        """Acumula una actualización de estado, fusionándola con las previas del mismo mensaje.
+
+        Un webhook puede traer varios estados de un mismo mensaje (p. ej. delivered y read);
+        se conserva el último estado y cualquier marca de entrega o lectura.
+        """
+        message_id = status.get("id")
+        status_type = status.get("status")
+        if not message_id or not status_type:
+            return
+        row = status_rows.setdefault(
+            message_id,
+            {"message_id": message_id, "delivered": False, "read": False},
+        )
+        row["status"] = status_type
+        if status_type == "delivered":
+            row["delivered"] = True
+        elif status_type == "read":
+            row["read"] = True
+
+    @staticmethod
+    def _apply_statuses(status_rows: list[dict[str, Any]]) -> None:
+        """Actualiza el estado de todos los mensajes con un único UPDATE ... FROM (VALUES ...).
+
+        No confirma la transacción: lo hace process_webhook al final del lote.
+        """
+        updates = values(
+            column("message_id", String),
+            column("status", String),
+            column("delivered", Boolean),
+            column("read", Boolean),
+            name="v",
+        ).data(
+            [
+                (row["message_id"], row["status"], row["delivered"], row["read"])
+                for row in status_rows
+            ]
+        )
+        # Las marcas de entrega y lectura las pone PostgreSQL con la hora de la transacción.
+        now = _utc_now()
+        stmt = (
+            update(WhatsAppMessage)
+            .where(WhatsAppMessage.message_id == updates.c.message_id)
+            .values(
+                status=updates.c.status,
+                delivered_at=case(
+                    (updates.c.delivered, now), else_=WhatsAppMessage.delivered_at
+                ),
+                read_at=case((updates.c.read, now), else_=WhatsAppMessage.read_at),
+            )
+        )
+        result = db.session.execute(stmt)
+        logger.debug(
+            "Estados de mensajes actualizados: %s de %s", result.rowcount, len(status_rows)
+        )
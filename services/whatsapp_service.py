@@ -1,33 +1,109 @@
 """Servicio para la integración con la API de WhatsApp."""
 
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, datetime, timedelta
 import logging
-from threading import Thread
+import os
+import threading
 from typing import Any, Final
 
+from cachetools import TTLCache
 from flask import Flask, current_app
+import orjson
 import requests
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import SQLAlchemyError
+from urllib3.util.retry import Retry
 
 from models import WhatsAppConnection, db
 from services import flow_executor
+from utils.circuit_breaker import CircuitBreaker
+from utils.http_session import SessionManager
+from utils.invalidation import InvalidationChannel
 
 logger: Final = logging.getLogger(__name__)
 
 # --- Constantes de Configuración ---
-API_TIMEOUT: Final[int] = 15  # segundos
+API_TIMEOUT: Final = (3.05, 15)  # segundos (conexión, lectura)
+# Hilos que ejecutan los flujos disparados por mensajes entrantes. Acotar el
+# número evita crear un hilo del sistema por mensaje durante una ráfaga.
+FLOW_WORKERS: Final = int(os.getenv("WA_FLOW_WORKERS", "8"))
+# Antigüedad máxima de un estado "connected" guardado antes de volver a
+# preguntarlo al proveedor; el frontend consulta el estado periódicamente.
+STATUS_MAX_AGE: Final = timedelta(seconds=60)
 
 # --- Constantes de Estado ---
 STATUS_CONNECTED: Final = "connected"
 STATUS_DISCONNECTED: Final = "disconnected"
 STATUS_ERROR: Final = "error"
 
+# Breaker compartido por todos los workers para las llamadas al microservicio.
+_api_breaker: Final = CircuitBreaker("whatsapp_api", "API de WhatsApp")
+
+# Sesión compartida con el microservicio: reutiliza las conexiones keep-alive
+# en lugar de abrir una conexión TCP nueva en cada llamada.
+_http_session_manager: Final = SessionManager(
+    pool_connections=4,
+    pool_maxsize=50,
+    retry=Retry(total=2, backoff_factor=0.2, status_forcelist=(502, 503, 504)),
+    schemes=("http://", "https://"),
+)
+get_http_session = _http_session_manager.get_session
+
+_flow_executor: Final = ThreadPoolExecutor(
+    max_workers=FLOW_WORKERS, thread_name_prefix="wa-flow"
+)
+
+# Caché en proceso del Plubot conectado, para no consultarlo en cada mensaje
+# entrante. Solo se guarda si hay uno; se descarta al cambiar cualquier conexión,
+# en todos los workers, a través de un canal de Redis.
+_CONNECTED_CACHE_TTL: Final = 30
+_CONNECTED_CACHE_KEY: Final = "plubot_id"
+_CONNECTED_INVALIDATE_CHANNEL: Final = "whatsapp:connected:invalidate"
+_connected_plubot_cache: Final = TTLCache(maxsize=1, ttl=_CONNECTED_CACHE_TTL)
+_connected_plubot_lock: Final = threading.Lock()
+
+
+def _clear_connected_plubot() -> None:
+    """Descarta el Plubot conectado cacheado en este proceso."""
+    with _connected_plubot_lock:
+        _connected_plubot_cache.pop(_CONNECTED_CACHE_KEY, None)
+
+
+_connected_invalidation: Final = InvalidationChannel(
+    _CONNECTED_INVALIDATE_CHANNEL, _clear_connected_plubot, "conexiones"
+)
+
+
+def _get_connected_plubot_id() -> int | None:
+    """Devuelve el ID del Plubot conectado, consultando la caché antes que la base de datos."""
+    _connected_invalidation.ensure_started()
+    with _connected_plubot_lock:
+        plubot_id = _connected_plubot_cache.get(_CONNECTED_CACHE_KEY)
+    if plubot_id is not None:
+        return plubot_id
+    plubot_id = db.session.scalar(
+        select(WhatsAppConnection.plubot_id).filter_by(status=STATUS_CONNECTED).limit(1)
+    )
+    if plubot_id is not None:
+        with _connected_plubot_lock:
+            _connected_plubot_cache[_CONNECTED_CACHE_KEY] = plubot_id
+    return plubot_id
+
+
+def invalidate_connected_plubot() -> None:
+    """Descarta el Plubot conectado cacheado tras modificar una conexión y avisa al resto."""
+    _connected_invalidation.publish()
+
 
 class WhatsAppService:
     """Gestiona la comunicación con la API de WhatsApp."""
 
     def __init__(self, app: Flask | None = None) -> None:
         """Inicializa el servicio con la configuración de la app Flask."""
-        self.app = app or current_app
+        # La app real y no el proxy current_app, que no es válido en los hilos del pool
+        self.app = app or current_app._get_current_object()  # noqa: SLF001
         self.api_url: str | None = self.app.config.get("WHATSAPP_API_URL")
         self.api_key: str | None = self.app.config.get("WHATSAPP_API_KEY")
 
@@ -41,32 +117,47 @@ class WhatsAppService:
     def _make_request(
         self, method: str, endpoint: str, **kwargs: Any  # noqa: ANN401
     ) -> requests.Response:
-        """Realiza una petición a la API de WhatsApp con manejo de errores y timeout."""
+        """Realiza una petición a la API de WhatsApp con manejo de errores y timeout.
+
+        Si el circuit breaker está abierto lanza ConnectionError sin hacer la
+        petición, de modo que quien llama lo trata como un fallo de red más.
+        """
         if not self.api_url:
             msg = "La URL de la API de WhatsApp no está configurada."
             raise ValueError(msg)
 
         url = f"{self.api_url}/{endpoint}"
+        if _api_breaker.is_open():
+            msg = f"API de WhatsApp en pausa por el circuit breaker; se omite {url}"
+            raise requests.exceptions.ConnectionError(msg)
         headers = self._get_headers()
 
         try:
-            response = requests.request(
+            response = get_http_session().request(
                 method,
                 url,
                 headers=headers,
                 timeout=API_TIMEOUT,
                 **kwargs,
             )
-            response.raise_for_status()
-        except requests.exceptions.RequestException:
-            logger.exception("Error en la comunicación con la API de WhatsApp")
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            logger.exception("No se pudo conectar con la API de WhatsApp")
+            _api_breaker.record_failure()
             raise
-        else:
-            return response
+
+        # Comprobación directa del código en lugar de raise_for_status: el camino
+        # habitual (2xx) no pasa por ningún manejador de excepciones.
+        if response.status_code >= 400:
+            logger.error(
+                "La API de WhatsApp respondió %s en %s", response.status_code, endpoint
+            )
+            msg = f"{response.status_code} en {url}"
+            raise requests.exceptions.HTTPError(msg, response=response)
+        return response
 
     def _extract_qr_code(self, response: requests.Response) -> str:
         """Extrae el código QR de la respuesta de la API."""
-        data = response.json()
+        data = orjson.loads(response.content)
         qr_base64 = data.get("qr")
         if not qr_base64:
             msg = "La respuesta de la API no contiene un código QR."
@@ -91,17 +182,38 @@ class WhatsAppService:
             return {"qrCodeUrl": qr_code_url}, 200
 
     def get_connection_status(self, plubot_id: str) -> tuple[dict[str, Any], int]:
-        """Verifica y actualiza el estado de la conexión de un Plubot."""
+        """Verifica y actualiza el estado de la conexión de un Plubot.
+
+        Un estado "connected" guardado hace menos de STATUS_MAX_AGE se devuelve
+        desde la base de datos sin llamar al proveedor.
+        """
+        connection = db.session.scalars(
+            select(WhatsAppConnection).filter_by(plubot_id=plubot_id).limit(1)
+        ).first()
+        # updated_at se guarda en UTC sin zona horaria
+        now = datetime.now(UTC).replace(tzinfo=None)
+        if (
+            connection
+            and connection.status == STATUS_CONNECTED
+            and connection.updated_at
+            and now - connection.updated_at < STATUS_MAX_AGE
+        ):
+            return {
+                "status": STATUS_CONNECTED,
+                "whatsappNumber": connection.whatsapp_number,
+            }, 200
+
         try:
             response = self._make_request("get", "users/profile")
-            data = response.json()
-        except requests.exceptions.RequestException as e:
-            if e.response and e.response.status_code in (401, 404):
+            data = orjson.loads(response.content)
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+            # Un Response con error es falsy: se compara con None para ver el 401/404
+            error_response = getattr(e, "response", None)
+            if error_response is not None and error_response.status_code in (401, 404):
                 self._update_connection_record(plubot_id, STATUS_DISCONNECTED)
                 return {"status": STATUS_DISCONNECTED}, 200
 
             logger.exception("Error al verificar el estado de WhatsApp para %s", plubot_id)
-            connection = WhatsAppConnection.query.filter_by(plubot_id=plubot_id).first()
             if connection:
                 return {
                     "status": connection.status,
@@ -125,32 +237,44 @@ class WhatsAppService:
     def _update_connection_record(
         self, plubot_id: str, status: str, whatsapp_number: str | None = None
     ) -> None:
-        """Actualiza el registro de conexión en la base de datos."""
-        try:
-            connection = WhatsAppConnection.query.filter_by(plubot_id=plubot_id).first()
+        """Actualiza el registro de conexión en la base de datos.
 
+        Cada estado se resuelve con sentencias directas (DELETE y un upsert con
+        INSERT ... ON CONFLICT) en una sola transacción, sin leer antes las filas.
+        """
+        try:
             if status == STATUS_DISCONNECTED:
-                if connection:
-                    db.session.delete(connection)
+                db.session.execute(
+                    delete(WhatsAppConnection).where(WhatsAppConnection.plubot_id == plubot_id)
+                )
             elif status == STATUS_CONNECTED:
                 # Desconectar cualquier otro plubot para evitar conflictos
-                existing = WhatsAppConnection.query.filter(
-                    WhatsAppConnection.plubot_id != plubot_id,
-                    WhatsAppConnection.status == STATUS_CONNECTED,
-                ).first()
-                if existing:
-                    db.session.delete(existing)
-
-                if not connection:
-                    connection = WhatsAppConnection(plubot_id=plubot_id)
-                    db.session.add(connection)
-                connection.status = status
-                connection.whatsapp_number = whatsapp_number
+                db.session.execute(
+                    delete(WhatsAppConnection).where(
+                        WhatsAppConnection.plubot_id != plubot_id,
+                        WhatsAppConnection.status == STATUS_CONNECTED,
+                    )
+                )
+                stmt = pg_insert(WhatsAppConnection).values(
+                    plubot_id=plubot_id, status=status, whatsapp_number=whatsapp_number
+                )
+                db.session.execute(
+                    stmt.on_conflict_do_update(
+                        index_elements=[WhatsAppConnection.plubot_id],
+                        set_={
+                            "status": stmt.excluded.status,
+                            "whatsapp_number": stmt.excluded.whatsapp_number,
+                            # onupdate no se aplica en un upsert: se fija aquí
+                            "updated_at": func.timezone("utc", func.now()),
+                        },
+                    )
+                )
         except SQLAlchemyError:
             logger.exception("Error de base de datos al actualizar el estado de conexión.")
             db.session.rollback()
         else:
             db.session.commit()
+            invalidate_connected_plubot()
 
     def disconnect_plubot(self, plubot_id: str) -> tuple[dict[str, Any], int]:
         """Desconecta un Plubot de WhatsApp."""
@@ -181,37 +305,44 @@ class WhatsAppService:
         if not all((sender_id, message_body)):
             return
 
-        connection = WhatsAppConnection.query.filter_by(
-            status=STATUS_CONNECTED
-        ).first()
-        if not connection:
+        plubot_id = _get_connected_plubot_id()
+        if plubot_id is None:
             logger.warning(
                 "Mensaje de %s recibido, pero no hay ningún Plubot conectado.", sender_id
             )
             return
 
-        thread = Thread(
-            target=self.process_flow,
-            args=(self.app, connection.plubot_id, sender_id, message_body),
-        )
-        thread.start()
+        _flow_executor.submit(self.process_flow, self.app, plubot_id, sender_id, message_body)
 
     @staticmethod
     def process_flow(
         app: Flask, plubot_id: str, user_id: str, message: str
     ) -> None:
-        """Procesa el flujo en un hilo separado con contexto de aplicación."""
+        """Procesa el flujo en un hilo del pool con contexto de aplicación.
+
+        Los errores se registran aquí: el pool los guardaría en un Future que nadie lee.
+        """
         with app.app_context():
-            flow_executor.trigger_flow(plubot_id, user_id, message)
+            try:
+                flow_executor.trigger_flow(plubot_id, user_id, message)
+            except Exception:
+                logger.exception(
+                    "Error ejecutando el flujo del Plubot %s para %s", plubot_id, user_id
+                )
 
     def send_whatsapp_message(
         self, plubot_id: str, to_number: str, message_text: str
     ) -> None:
         """Envía un mensaje de texto a través de WhatsApp."""
-        connection = WhatsAppConnection.query.filter_by(
-            plubot_id=plubot_id, status=STATUS_CONNECTED
-        ).first()
-        if not connection:
+        # Lo habitual es enviar desde el Plubot conectado en caché; si no, se consulta
+        is_connected = str(_get_connected_plubot_id()) == str(plubot_id)
+        if not is_connected:
+            is_connected = db.session.scalar(
+                select(WhatsAppConnection.id)
+                .filter_by(plubot_id=plubot_id, status=STATUS_CONNECTED)
+                .limit(1)
+            ) is not None
+        if not is_connected:
             logger.error(
                 "Intento de enviar mensaje desde un plubot no conectado: %s", plubot_id
             )
@@ -219,7 +350,8 @@ class WhatsAppService:
 
         payload = {"to": to_number, "body": message_text}
         try:
-            self._make_request("post", "messages/text", json=payload)
+            # Content-Type ya va en los encabezados de _make_request
+            self._make_request("post", "messages/text", data=orjson.dumps(payload))
         except requests.exceptions.RequestException:
             logger.exception("Error al enviar mensaje vía API de WhatsApp.")
         else:
@@ -1,8 +1,9 @@
-from datetime import UTC, datetime
 import logging
 from pathlib import Path
 import sys
 
+from sqlalchemy import func, or_, update
+
 # Añadir el directorio raíz del proyecto al sys.path
 project_root = Path(__file__).resolve().parent.parent
 sys.path.append(str(project_root))
@@ -17,20 +18,33 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 def fix_all_users() -> None:
-    """Itera sobre todos los usuarios y establece valores predeterminados.
+    """Establece valores predeterminados en todos los usuarios con un único UPDATE.
 
     Establece valores para los campos level, plucoins y created_at si están
-    vacíos.
+    vacíos (un level 0 también cuenta como vacío). Solo se reescriben las filas
+    afectadas y los valores los calcula la base de datos, sin cargar usuarios.
     """
     with get_session() as session:
-        users = session.query(User).all()
-        for user in users:
-            user.level = user.level or 1
-            user.plucoins = user.plucoins or 0
-            user.created_at = user.created_at or datetime.now(UTC)
+        result = session.execute(
+            update(User)
+            .where(
+                or_(
+                    User.level.is_(None),
+                    User.level == 0,
+                    User.plucoins.is_(None),
+                    User.created_at.is_(None),
+                )
+            )
+            .values(
+                level=func.coalesce(func.nullif(User.level, 0), 1),
+                plucoins=func.coalesce(User.plucoins, 0),
+                created_at=func.coalesce(
+                    User.created_at, func.timezone("utc", func.now())
+                ),
+            )
+        )
         session.commit()
-        logger.info("Usuarios actualizados: %d", len(users))
-
+        logger.info("Usuarios actualizados: %d", result.rowcount)
 
 if __name__ == "__main__":
     logger.info("Iniciando la corrección de todos los usuarios...")
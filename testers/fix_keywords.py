@@ -4,6 +4,7 @@ from pathlib import Path
 import sys
 
 from flask import Flask
+from sqlalchemy import text
 
 # Añadir el directorio raíz del proyecto al sys.path para poder importar los módulos
 project_root = Path(__file__).resolve().parent.parent
@@ -12,7 +13,6 @@ sys.path.append(str(project_root))
 # Imports de la aplicación (después de modificar el path)
 from config.settings import load_config  # noqa: E402
 from models import db  # noqa: E402
-from models.knowledge_item import KnowledgeItem  # noqa: E402
 
 # Configuración del logging
 logging.basicConfig(
@@ -24,18 +24,42 @@ app = Flask(__name__)
 load_config(app)
 db.init_app(app)
 
+# Equivale a `",".join(kw.strip().lower() for kw in keywords.split(",") if kw.strip())`
+# calculado en PostgreSQL; solo se reescriben las filas cuyo valor cambia.
+NORMALIZE_KEYWORDS_SQL = text(r"""
+    WITH cleaned AS (
+        SELECT
+            ki.id,
+            COALESCE((
+                SELECT string_agg(lower(kw), ',' ORDER BY n)
+                FROM (
+                    SELECT regexp_replace(k, '^\s+|\s+$', '', 'g') AS kw, n
+                    FROM unnest(string_to_array(ki.keywords, ',')) WITH ORDINALITY AS t(k, n)
+                ) AS parts
+                WHERE kw <> ''
+            ), '') AS keywords
+        FROM knowledge_items AS ki
+        WHERE ki.keywords IS NOT NULL
+    )
+    UPDATE knowledge_items
+    SET keywords = cleaned.keywords
+    FROM cleaned
+    WHERE knowledge_items.id = cleaned.id
+      AND knowledge_items.keywords <> cleaned.keywords
+""")
+
 def fix_keywords() -> None:
-    """Limpia y normaliza las palabras clave en todos los KnowledgeItem."""
+    """Limpia y normaliza las palabras clave en todos los KnowledgeItem.
+
+    La normalización se hace con un único UPDATE en la base de datos, sin
+    cargar los elementos en Python.
+    """
     with app.app_context():
-        items = KnowledgeItem.query.all()
-        for item in items:
-            # Limpiar y normalizar las palabras clave
-            cleaned_keywords = [
-                kw.strip().lower() for kw in item.keywords.split(",") if kw.strip()
-            ]
-            item.keywords = ",".join(cleaned_keywords)
+        result = db.session.execute(NORMALIZE_KEYWORDS_SQL)
         db.session.commit()
-        logger.info("Palabras clave corregidas en la base de datos.")
+        logger.info(
+            "Palabras clave corregidas en la base de datos: %d elementos.", result.rowcount
+        )
 
 if __name__ == "__main__":
     logger.info("Corrigiendo palabras clave en knowledge_items...")
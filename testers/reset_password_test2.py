@@ -1,4 +1,5 @@
 import logging
+import os
 from pathlib import Path
 import sys
 
@@ -17,12 +18,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Coste de bcrypt (2^rounds iteraciones); 12 es el valor por defecto de la librería
+# y el que usa la API, así que solo conviene bajarlo para pruebas.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt solo usa los primeros 72 bytes de la contraseña
+BCRYPT_MAX_BYTES = 72
+
 def reset_password(email: str, new_pass: str) -> None:
     """Busca un usuario por email y resetea su contraseña."""
+    password = new_pass.encode("utf-8")
+    if len(password) > BCRYPT_MAX_BYTES:
+        logger.error("La contraseña supera los %d bytes que admite bcrypt", BCRYPT_MAX_BYTES)
+        return
+
     with get_session() as session:
         user = session.query(User).filter_by(email=email).first()
         if user:
-            hashed_pw = bcrypt.hashpw(new_pass.encode("utf-8"), bcrypt.gensalt())
+            hashed_pw = bcrypt.hashpw(password, bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
             user.password = hashed_pw.decode("utf-8")
             session.commit()
             logger.info("Contraseña actualizada para: %s", user.email)
@@ -9,6 +9,7 @@ from pathlib import Path
 import sys
 
 from flask import Flask
+from sqlalchemy.orm import load_only
 
 # Añadir el directorio raíz del proyecto al sys.path para permitir importaciones locales
 project_root = Path(__file__).resolve().parent.parent
@@ -41,7 +42,10 @@ def test_search() -> None:
 
         # Mostrar todos los registros para inspeccionar
         logger.info("\nRegistros en knowledge_items:")
-        items = KnowledgeItem.query.all()
+        # Solo las columnas que se muestran, leídas por lotes en lugar de todas de golpe
+        items = KnowledgeItem.query.options(
+            load_only(KnowledgeItem.question, KnowledgeItem.answer, KnowledgeItem.keywords)
+        ).yield_per(200)
         for item in items:
             keywords_set = set(item.keywords.lower().split(","))
             logger.info("- Pregunta: %s", item.question)
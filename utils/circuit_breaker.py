@@ -0,0 +1,71 @@
+"""Circuit breaker sobre Redis, compartido por todos los workers.
+
+Tras `threshold` fallos de conexión dentro de `window` segundos, el breaker se
+abre durante `open_seconds` y las llamadas se cortan en lugar de bloquear
+workers esperando a un servicio caído. Sin Redis, el breaker queda cerrado.
+"""
+import logging
+from typing import Final
+
+import redis
+
+from utils.redis_client import get_redis_client
+
+logger: Final = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+    """Breaker de un servicio externo, con su estado en las claves `{prefix}:breaker:*`."""
+
+    __slots__ = ("_failures_key", "_open_key", "name", "open_seconds", "threshold", "window")
+
+    def __init__(
+        self,
+        prefix: str,
+        name: str,
+        *,
+        threshold: int = 5,
+        window: int = 30,
+        open_seconds: int = 30,
+    ) -> None:
+        """Configura el breaker; `name` identifica al servicio en los logs."""
+        self._failures_key = f"{prefix}:breaker:failures"
+        self._open_key = f"{prefix}:breaker:open"
+        self.name = name
+        self.threshold = threshold
+        self.window = window
+        self.open_seconds = open_seconds
+
+    def is_open(self) -> bool:
+        """Indica si el breaker está abierto."""
+        redis_client = get_redis_client()
+        if not redis_client:
+            return False
+        try:
+            return bool(redis_client.exists(self._open_key))
+        except redis.exceptions.RedisError:
+            logger.exception("Error leyendo el circuit breaker de %s.", self.name)
+            return False
+
+    def record_failure(self) -> None:
+        """Cuenta un fallo de conexión y abre el breaker al alcanzar el umbral."""
+        redis_client = get_redis_client()
+        if not redis_client:
+            return
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            pipe.incr(self._failures_key)
+            pipe.expire(self._failures_key, self.window)
+            failures, _ = pipe.execute()
+            if failures >= self.threshold:
+                pipe.set(self._open_key, "1", ex=self.open_seconds)
+                pipe.delete(self._failures_key)
+                pipe.execute()
+                logger.warning(
+                    "%s inaccesible tras %s intentos; se cortan las llamadas durante %ss.",
+                    self.name,
+                    failures,
+                    self.open_seconds,
+                )
+        except redis.exceptions.RedisError:
+            logger.exception("Error actualizando el circuit breaker de %s.", self.name)
@@ -0,0 +1,44 @@
+"""Sesiones HTTP compartidas con pool de conexiones keep-alive y reintentos."""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class SessionManager:
+    """Crea una requests.Session en el primer uso y la reutiliza en cada llamada.
+
+    Compartir la sesión entre peticiones mantiene abiertas las conexiones TCP y
+    TLS del pool. Retry solo repite los métodos de su `allowed_methods`; el valor
+    por defecto de urllib3 excluye POST, de modo que un envío no se duplica.
+    """
+
+    __slots__ = ("_pool_connections", "_pool_maxsize", "_retry", "_schemes", "_session")
+
+    def __init__(
+        self,
+        *,
+        pool_connections: int,
+        pool_maxsize: int,
+        retry: Retry,
+        schemes: tuple[str, ...] = ("https://",),
+    ) -> None:
+        """Guarda la configuración del pool; la sesión se crea al pedirla."""
+        self._pool_connections = pool_connections
+        self._pool_maxsize = pool_maxsize
+        self._retry = retry
+        self._schemes = schemes
+        self._session: requests.Session | None = None
+
+    def get_session(self) -> requests.Session:
+        """Devuelve la sesión compartida, creándola en el primer uso."""
+        if self._session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=self._pool_connections,
+                pool_maxsize=self._pool_maxsize,
+                max_retries=self._retry,
+            )
+            for scheme in self._schemes:
+                session.mount(scheme, adapter)
+            self._session = session
+        return self._session
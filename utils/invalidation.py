@@ -0,0 +1,56 @@
+"""Invalidación de cachés locales entre workers a través de un canal pub/sub de Redis."""
+from collections.abc import Callable
+import logging
+from typing import Any, Final
+
+import redis
+
+from utils.redis_client import get_redis_client
+
+logger: Final = logging.getLogger(__name__)
+
+
+class InvalidationChannel:
+    """Canal de Redis que avisa a todos los procesos de que limpien una caché en memoria.
+
+    Cada proceso se suscribe, en un hilo de Redis en segundo plano, la primera vez
+    que usa la caché. Sin Redis, la caché solo se limpia en el proceso que publica.
+    """
+
+    __slots__ = ("_channel", "_clear", "_name", "_started")
+
+    def __init__(self, channel: str, clear: Callable[[], None], name: str) -> None:
+        """Asocia el canal a la función que limpia la caché; `name` se usa en los logs."""
+        self._channel = channel
+        self._clear = clear
+        self._name = name
+        self._started = False
+
+    def ensure_started(self) -> None:
+        """Suscribe el proceso al canal la primera vez que se llama."""
+        if self._started:
+            return
+        self._started = True
+        redis_client = get_redis_client()
+        if not redis_client:
+            return
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self._channel: self._on_message})
+            pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+        except redis.exceptions.RedisError:
+            logger.exception("No se pudo suscribir al canal de invalidación de %s.", self._name)
+
+    def publish(self) -> None:
+        """Limpia la caché de este proceso y notifica al resto de workers."""
+        self._clear()
+        redis_client = get_redis_client()
+        if not redis_client:
+            return
+        try:
+            redis_client.publish(self._channel, "1")
+        except redis.exceptions.RedisError:
+            logger.exception("No se pudo publicar la invalidación de %s.", self._name)
+
+    def _on_message(self, _message: dict[str, Any]) -> None:
+        self._clear()
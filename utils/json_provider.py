@@ -0,0 +1,27 @@
+"""Proveedor JSON de Flask respaldado por orjson."""
+
+from typing import Any
+
+from flask.json.provider import DefaultJSONProvider
+import orjson
+
+# Las fechas pasan por el `default` de Flask para conservar su formato (RFC 822)
+# en las respuestas existentes; las claves no str se convierten como en json.
+_DUMPS_OPTIONS = (
+    orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Serializa y deserializa con orjson en lugar del módulo json estándar.
+
+    Se usa para `jsonify`, `request.get_json` y el resto de JSON de la aplicación.
+    """
+
+    def dumps(self, obj: Any, **_kwargs: Any) -> str:  # noqa: ANN401
+        """Serializa `obj` a JSON; los objetos no nativos los resuelve `default`."""
+        return orjson.dumps(obj, default=self.default, option=_DUMPS_OPTIONS).decode()
+
+    def loads(self, s: str | bytes, **_kwargs: Any) -> Any:  # noqa: ANN401
+        """Deserializa un documento JSON."""
+        return orjson.loads(s)
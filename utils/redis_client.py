@@ -0,0 +1,104 @@
+"""Shared Redis client for caches, locks and counters used across services.
+
+The pool is built lazily so each forked worker owns its sockets, and a failed
+connection backs off for REDIS_RECONNECT_COOLDOWN seconds before retrying.
+"""
+from functools import lru_cache
+import logging
+import os
+import socket
+import time
+
+import redis
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Redis pool size: at least 50 connections, or 2 per gunicorn worker.
+REDIS_MAX_CONNECTIONS = max(50, 2 * int(os.getenv("WEB_CONCURRENCY", "1")))
+# Seconds to wait before trying to reconnect after Redis becomes unreachable.
+REDIS_RECONNECT_COOLDOWN = 30
+
+
+def _redis_keepalive_options() -> dict[int, int]:
+    """TCP keepalive tuning so idle sockets survive NAT and load-balancer reaping."""
+    # These constants are platform specific (e.g. TCP_KEEPIDLE is Linux-only).
+    wanted = {"TCP_KEEPIDLE": 60, "TCP_KEEPINTVL": 10, "TCP_KEEPCNT": 3}
+    return {
+        getattr(socket, name): value
+        for name, value in wanted.items()
+        if hasattr(socket, name)
+    }
+
+
+@lru_cache(maxsize=1)
+def _get_redis_pool() -> redis.ConnectionPool:
+    """Build the Redis connection pool on first use.
+
+    Building it lazily means each forked gunicorn worker creates its own pool
+    instead of inheriting the parent's sockets. Later reconnects reuse it.
+    """
+    # redis-py picks the hiredis parser automatically when it is installed.
+    return redis.ConnectionPool.from_url(
+        settings.REDIS_URL,
+        decode_responses=True,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        socket_keepalive=True,
+        socket_keepalive_options=_redis_keepalive_options(),
+        health_check_interval=30,
+        retry_on_timeout=True,
+    )
+
+
+class _RedisManager:
+    """Manages a singleton Redis client instance to avoid using globals."""
+
+    _client: redis.Redis | None = None
+    _connected: bool = False
+    _retry_after: float = 0.0
+
+    def get_client(self) -> redis.Redis | None:
+        """Return the Redis client once it has answered a ping.
+
+        If the connection fails, it returns None and logs the error. Reconnection
+        is then attempted lazily, at most once per cooldown period, reusing the
+        same client and pool.
+        """
+        if not self._connected:
+            if not settings.REDIS_URL:
+                logger.warning("Redis URL not configured. Cache service is disabled.")
+                return None
+            if time.monotonic() < self._retry_after:
+                return None
+            if self._client is None:
+                # TLS and other options come from the REDIS_URL scheme via from_url.
+                self._client = redis.Redis(
+                    connection_pool=_get_redis_pool(), single_connection_client=False
+                )
+            try:
+                # Drop sockets left over from the outage before checking again.
+                self._client.connection_pool.disconnect()
+                self._client.ping()
+                self._connected = True
+                logger.info(
+                    "Successfully connected to Redis for caching (hiredis: %s).",
+                    redis.utils.HIREDIS_AVAILABLE,
+                )
+            except redis.exceptions.ConnectionError:
+                logger.exception(
+                    "Could not connect to Redis, caching will be disabled."
+                )
+                self._retry_after = time.monotonic() + REDIS_RECONNECT_COOLDOWN
+                return None
+        return self._client
+
+    def mark_unavailable(self) -> None:
+        """Flag the client as down after a connection error and back off before retrying."""
+        self._connected = False
+        self._retry_after = time.monotonic() + REDIS_RECONNECT_COOLDOWN
+
+
+_redis_manager = _RedisManager()
+get_redis_client = _redis_manager.get_client
+mark_redis_unavailable = _redis_manager.mark_unavailable